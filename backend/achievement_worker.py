@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Awaitable, Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class AchievementWorker:
+    """Evaluates achievements on a pool of asyncio tasks fed by a bounded queue
+
+    With workers == 0 the worker is disabled and submit() always refuses, so
+    callers evaluate inline. Either way the unlocks are recorded per player so
+    they can be read back through /api/achievements/{player_name}/recent.
+    """
+
+    def __init__(self, evaluate: Callable[..., Awaitable[List[dict]]], workers: int = 0,
+                 max_queue: int = 1000, recent_per_player: int = 20, max_players: int = 10000):
+        self._evaluate = evaluate
+        self.workers = workers
+        self.max_queue = max_queue
+        self._recent_per_player = recent_per_player
+        self._max_players = max_players
+        self._queue = None
+        self._draining = False
+        self._tasks = []
+        self._pending = {}
+        self._recent = OrderedDict()
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._queue is not None and not self._draining
+
+    def start(self):
+        """Start the worker tasks; must run inside the event loop"""
+        if self.workers <= 0 or self.enabled:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+        logger.info("Achievement worker started with %d tasks, queue size %d", self.workers, self.max_queue)
+
+    def submit(self, player_name: str, **job) -> bool:
+        """Queue an evaluation; False when disabled or the queue is full so the caller runs it inline"""
+        if not self.enabled:
+            return False
+        try:
+            self._queue.put_nowait((player_name, job))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self._pending[player_name] = self._pending.get(player_name, 0) + 1
+        return True
+
+    async def run_inline(self, player_name: str, **job) -> List[dict]:
+        """Evaluate in the caller's task; a failure is counted and logged like a queued job's"""
+        try:
+            return await self._evaluate(player_name, **job)
+        except Exception:
+            self.failed += 1
+            logger.exception("Achievement evaluation failed for %s", player_name)
+            return []
+
+    async def _run(self):
+        while True:
+            player_name, job = await self._queue.get()
+            try:
+                await self._evaluate(player_name, **job)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logger.exception("Achievement evaluation failed for %s", player_name)
+            finally:
+                pending = self._pending.get(player_name, 1) - 1
+                if pending > 0:
+                    self._pending[player_name] = pending
+                else:
+                    self._pending.pop(player_name, None)
+                self._queue.task_done()
+
+    def record(self, player_name: str, unlocked: List[Tuple[dict, datetime]]):
+        """Remember a player's new unlocks, each with the unlock time storage kept"""
+        if not unlocked:
+            return
+        recent = self._recent.get(player_name)
+        if recent is None:
+            recent = self._recent[player_name] = deque(maxlen=self._recent_per_player)
+            if len(self._recent) > self._max_players:
+                self._recent.popitem(last=False)
+        else:
+            self._recent.move_to_end(player_name)
+        recent.extend(unlocked)
+
+    def recent(self, player_name: str):
+        """Return (pending job count, [(achievement, unlocked_at)]) for a player, newest first"""
+        return self._pending.get(player_name, 0), list(reversed(self._recent.get(player_name, ())))
+
+    async def drain(self, timeout: float = 10.0):
+        """Wait for queued evaluations to finish, then stop the worker tasks"""
+        if not self.enabled:
+            return
+        # Refuse new jobs so late submissions run inline instead of being lost
+        self._draining = True
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Achievement queue not drained after %.1fs, %d jobs dropped", timeout, self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._draining = False
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "workers": len(self._tasks),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+        }
@@ -1,7 +1,10 @@
+from bisect import bisect_left, bisect_right
+
 # Achievement definitions
 ACHIEVEMENTS = [
     {
         "id": "first_steps",
+        "bit": 0,
         "name": "Primeiros Passos",
         "description": "Alcance 10 metros de altura",
         "icon": "🏃‍♂️",
@@ -10,6 +13,7 @@ ACHIEVEMENTS = [
     },
     {
         "id": "getting_high",
+        "bit": 1,
         "name": "Subindo Alto",
         "description": "Alcance 50 metros de altura",
         "icon": "🌤️",
@@ -18,6 +22,7 @@ ACHIEVEMENTS = [
     },
     {
         "id": "sky_walker",
+        "bit": 2,
         "name": "Caminhante do Céu",
         "description": "Alcance 100 metros de altura",
         "icon": "☁️",
@@ -26,6 +31,7 @@ ACHIEVEMENTS = [
     },
     {
         "id": "stratosphere",
+        "bit": 3,
         "name": "Estratosfera",
         "description": "Alcance 200 metros de altura",
         "icon": "🌌",
@@ -34,6 +40,7 @@ ACHIEVEMENTS = [
     },
     {
         "id": "redemption",
+        "bit": 4,
         "name": "Redenção",
         "description": "Complete o jogo alcançando o símbolo da reciclagem",
         "icon": "♻️",
@@ -42,6 +49,7 @@ ACHIEVEMENTS = [
     },
     {
         "id": "speed_runner",
+        "bit": 5,
         "name": "Velocista",
         "description": "Complete o jogo em menos de 5 minutos",
         "icon": "⚡",
@@ -50,6 +58,7 @@ ACHIEVEMENTS = [
     },
     {
         "id": "persistent",
+        "bit": 6,
         "name": "Persistente",
         "description": "Jogue 10 partidas",
         "icon": "💪",
@@ -58,6 +67,7 @@ ACHIEVEMENTS = [
     },
     {
         "id": "master_jumper",
+        "bit": 7,
         "name": "Mestre dos Saltos",
         "description": "Complete o jogo 3 vezes",
         "icon": "👑",
@@ -66,17 +76,96 @@ ACHIEVEMENTS = [
     }
 ]
 
+# Unlocks are stored as a bitmask of these positions: never reuse or renumber a bit,
+# give new achievements the next free one
+MAX_BITS = 63
+
+def _index_bits():
+    by_bit = {}
+    for achievement in ACHIEVEMENTS:
+        bit = achievement["bit"]
+        if not 0 <= bit < MAX_BITS or bit in by_bit:
+            raise ValueError(f"Invalid or duplicate bit {bit} in achievement {achievement['id']!r}")
+        by_bit[bit] = achievement
+    return by_bit
+
+ACHIEVEMENTS_BY_BIT = _index_bits()
+ACHIEVEMENT_BITS = {achievement["id"]: achievement["bit"] for achievement in ACHIEVEMENTS}
+
+def unlock_mask(achievement_ids) -> int:
+    """Bitmask of a set of achievement ids; unknown ids raise KeyError"""
+    mask = 0
+    for achievement_id in achievement_ids:
+        mask |= 1 << ACHIEVEMENT_BITS[achievement_id]
+    return mask
+
+def decode_unlocks(mask: int, timestamps: dict) -> dict:
+    """Map of achievement id to unlock time from a stored mask and its timestamps keyed by bit"""
+    return {
+        achievement["id"]: timestamps.get(str(bit))
+        for bit, achievement in ACHIEVEMENTS_BY_BIT.items()
+        if mask >> bit & 1
+    }
+
+# Rules compiled once at import: achievements grouped by criteria type, and the
+# threshold-based ones sorted by threshold so lookups are a bisection
+CRITERIA_TYPES = ("height", "completion", "completion_time", "completions", "games_played")
+
+def _compile_rules():
+    by_type = {criteria_type: [] for criteria_type in CRITERIA_TYPES}
+    for achievement in ACHIEVEMENTS:
+        criteria_type = achievement["unlock_criteria"]["type"]
+        if criteria_type not in by_type:
+            raise ValueError(f"Unknown criteria type {criteria_type!r} in achievement {achievement['id']!r}")
+        by_type[criteria_type].append(achievement)
+    
+    thresholds = {}
+    for criteria_type in ("height", "completion_time", "completions", "games_played"):
+        rules = sorted(by_type[criteria_type], key=lambda a: a["unlock_criteria"]["value"])
+        thresholds[criteria_type] = ([a["unlock_criteria"]["value"] for a in rules], rules)
+    return by_type, thresholds
+
+_RULES_BY_TYPE, _THRESHOLDS = _compile_rules()
+_CATALOG_ORDER = {achievement["id"]: position for position, achievement in enumerate(ACHIEVEMENTS)}
+_COMPLETION_RULES = [
+    achievement for achievement in ACHIEVEMENTS
+    if achievement["unlock_criteria"]["type"] in ("completion", "completion_time", "completions")
+]
+
+def _at_most(criteria_type: str, value):
+    """Achievements of a type whose threshold is <= value"""
+    values, rules = _THRESHOLDS[criteria_type]
+    return rules[:bisect_right(values, value)]
+
+def _at_least(criteria_type: str, value):
+    """Achievements of a type whose threshold is >= value"""
+    values, rules = _THRESHOLDS[criteria_type]
+    return rules[bisect_left(values, value):]
+
 def get_achievements_for_height(height: int):
     """Return achievements that should be unlocked for a given height"""
-    return [
-        achievement for achievement in ACHIEVEMENTS 
-        if achievement["unlock_criteria"]["type"] == "height" 
-        and achievement["unlock_height"] <= height
-    ]
+    return _at_most("height", height)
+
+def next_height_threshold(height: int):
+    """Smallest height achievement threshold above height, or None past the last one"""
+    values, _ = _THRESHOLDS["height"]
+    index = bisect_right(values, height)
+    return values[index] if index < len(values) else None
 
 def get_completion_achievements():
     """Return achievements that require game completion"""
-    return [
-        achievement for achievement in ACHIEVEMENTS 
-        if achievement["unlock_criteria"]["type"] in ["completion", "completion_time", "completions"]
-    ]
\ No newline at end of file
+    return list(_COMPLETION_RULES)
+
+def get_unlockable_achievements(unlocked_ids, height: int, completed: bool, completion_time, games_played: int, completions: int):
+    """Return the achievements not in unlocked_ids that a score and the player's counters earn"""
+    candidates = _at_most("height", height) + _at_most("games_played", games_played)
+    if completed:
+        candidates += _RULES_BY_TYPE["completion"] + _at_most("completions", completions)
+        if completion_time:
+            candidates += _at_least("completion_time", completion_time)
+    
+    # Keep catalog order so unlocks are reported the same way regardless of criteria type
+    return sorted(
+        (achievement for achievement in candidates if achievement["id"] not in unlocked_ids),
+        key=lambda a: _CATALOG_ORDER[a["id"]]
+    )
@@ -0,0 +1,192 @@
+import asyncio
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fast_json import dumps
+from models import LeaderboardEntry
+
+
+class LeaderboardCache:
+    """In-process leaderboard snapshots keyed by limit, with TTL and single-flight refresh
+
+    Each snapshot also keeps its JSON body once encoded, so repeated reads of
+    an unchanged board send the same bytes without serializing again. Boards
+    of a day, week or month pass their period key, and a snapshot of another
+    period is a miss, so a rollover is never answered from the last period.
+    """
+
+    def __init__(self, ttl: float = 30.0):
+        self.ttl = ttl
+        # limit -> [expires at, entries, encoded body or None, period]
+        self._snapshots: Dict[int, list] = {}
+        self._inflight: Dict[Tuple[int, Optional[str]], asyncio.Future] = {}
+        # Bumped on every invalidation so a refresh started before it is not stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.invalidations = 0
+
+    async def get(self, limit: int, loader: Callable[[int], Awaitable[List[LeaderboardEntry]]],
+                  period: Optional[str] = None) -> List[LeaderboardEntry]:
+        """Return the snapshot for limit, loading it at most once for concurrent callers"""
+        snapshot = self._snapshots.get(limit)
+        if snapshot is not None and snapshot[3] == period and snapshot[0] > time.monotonic():
+            self.hits += 1
+            return snapshot[1]
+
+        self.misses += 1
+        refresh = self._inflight.get((limit, period))
+        if refresh is None:
+            refresh = asyncio.ensure_future(self._refresh(limit, loader, period))
+            self._inflight[(limit, period)] = refresh
+        # Shield so a cancelled request does not cancel the refresh other requests wait on
+        return await asyncio.shield(refresh)
+
+    async def get_body(self, limit: int, loader: Callable[[int], Awaitable[List[LeaderboardEntry]]],
+                       period: Optional[str] = None) -> bytes:
+        """The snapshot for limit as JSON bytes, encoded once per snapshot"""
+        entries = await self.get(limit, loader, period)
+        snapshot = self._snapshots.get(limit)
+        if snapshot is None or snapshot[1] is not entries:
+            # Invalidated while loading; encode without keeping the body
+            return dumps([entry.model_dump() for entry in entries])
+        if snapshot[2] is None:
+            snapshot[2] = dumps([entry.model_dump() for entry in entries])
+        return snapshot[2]
+
+    async def _refresh(self, limit: int, loader: Callable[[int], Awaitable[List[LeaderboardEntry]]],
+                       period: Optional[str]) -> List[LeaderboardEntry]:
+        self.refreshes += 1
+        generation = self._generation
+        try:
+            entries = await loader(limit)
+            if generation == self._generation:
+                self._snapshots[limit] = [time.monotonic() + self.ttl, entries, None, period]
+            return entries
+        finally:
+            self._inflight.pop((limit, period), None)
+
+    def invalidate_for(self, player_name: str, height: int, completions: int):
+        """Drop the snapshots whose visible ranking a player's new stats could change"""
+        self._generation += 1
+        for limit, (_, entries, _, _) in list(self._snapshots.items()):
+            if self._affects(entries, limit, player_name, height, completions):
+                del self._snapshots[limit]
+                self.invalidations += 1
+
+    def invalidate_all(self):
+        self._generation += 1
+        self.invalidations += len(self._snapshots)
+        self._snapshots.clear()
+
+    @staticmethod
+    def _affects(entries: List[LeaderboardEntry], limit: int, player_name: str, height: int, completions: int) -> bool:
+        if len(entries) < limit:
+            return True
+        if any(entry.name == player_name for entry in entries):
+            return True
+        last = entries[-1]
+        return (height, completions) >= (last.height, last.completions)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "snapshots": len(self._snapshots),
+        }
+
+
+class UnlockCache:
+    """LRU of each player's unlocked achievements, bounded by player count and estimated memory
+
+    Entries map achievement id to unlock time and are dropped whenever the
+    player unlocks something, since the unlock time is only known to storage,
+    or after ttl seconds, which bounds how long unlocks made through another
+    worker go unseen.
+    """
+
+    def __init__(self, max_players: int = 10000, max_bytes: int = 16 * 1024 * 1024, ttl: float = 30.0):
+        self.max_players = max_players
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # player -> (unlocks, estimated size, expiry)
+        self._entries: "OrderedDict[str, Tuple[Dict[str, datetime], int, float]]" = OrderedDict()
+        self._bytes = 0
+        # Bumped on every invalidation so a load started before it is not stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    async def get(self, player_name: str, loader: Callable[[str], Awaitable[Dict[str, datetime]]]) -> Dict[str, datetime]:
+        """A player's unlocks; callers must not modify the returned map"""
+        entry = self._entries.get(player_name)
+        if entry is not None:
+            if entry[2] > time.monotonic():
+                self.hits += 1
+                self._entries.move_to_end(player_name)
+                return entry[0]
+            del self._entries[player_name]
+            self._bytes -= entry[1]
+            self.expirations += 1
+
+        self.misses += 1
+        generation = self._generation
+        unlocks = await loader(player_name)
+        if generation == self._generation and player_name not in self._entries:
+            self._store(player_name, unlocks)
+        return unlocks
+
+    def _store(self, player_name: str, unlocks: Dict[str, datetime]):
+        size = self._estimate(player_name, unlocks)
+        if size > self.max_bytes:
+            return
+        self._entries[player_name] = (unlocks, size, time.monotonic() + self.ttl)
+        self._bytes += size
+        while len(self._entries) > self.max_players or self._bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    @staticmethod
+    def _estimate(player_name: str, unlocks: Dict[str, datetime]) -> int:
+        size = sys.getsizeof(player_name) + sys.getsizeof(unlocks)
+        for achievement_id, unlocked_at in unlocks.items():
+            size += sys.getsizeof(achievement_id) + sys.getsizeof(unlocked_at)
+        return size
+
+    def invalidate(self, player_name: str):
+        self._generation += 1
+        entry = self._entries.pop(player_name, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+            self.invalidations += 1
+
+    def invalidate_all(self):
+        self._generation += 1
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "players": len(self._entries),
+            "bytes": self._bytes,
+        }
@@ -0,0 +1,225 @@
+"""
+Cache coherence between worker processes.
+
+Every worker keeps its own leaderboard snapshots, rank index, unlock cache
+and ETag counters, and updates them when it handles a write. For the other
+workers to follow, each write is also published as a small change record
+("board", "windows", "stats" or "unlocks", with the player and stats it
+concerns) to a shared version-stamp document:
+
+    {"_id": "cache", "v": <version>, "changes": [<the last keep records>]}
+
+Publishing appends records and raises v by their number, so the last record
+always carries version v. Workers read the document only when v has moved
+past the version they have applied, either by polling or, on a replica set,
+when a change stream reports an update, and hand the records they have not
+seen to per-kind handlers that invalidate just the keys concerned. A worker
+that falls more than keep records behind resyncs everything instead.
+
+Records are buffered and published together every interval, so a burst of
+writes costs one update of the document.
+
+The document lives in MongoDB (mongo_storage.MongoVersionStore) or, to run
+several local workers without a database, in a SQLite file
+(SqliteVersionStore).
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Change records kept in the version document for workers that fall behind
+KEEP_CHANGES = 1000
+
+
+class SqliteVersionStore:
+    """Version-stamp document in a SQLite file shared by local worker processes"""
+
+    can_watch = False
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache_versions (id TEXT PRIMARY KEY, v INTEGER NOT NULL, changes TEXT NOT NULL)"
+        )
+        return connection
+
+    def _bump(self, changes: List[dict], keep: int):
+        connection = self._connect()
+        try:
+            # Take the write lock before reading so concurrent bumps serialize
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT v, changes FROM cache_versions WHERE id = 'cache'").fetchone()
+            version, stored = (row[0], json.loads(row[1])) if row else (0, [])
+            stored = (stored + changes)[-keep:]
+            connection.execute(
+                "INSERT OR REPLACE INTO cache_versions (id, v, changes) VALUES ('cache', ?, ?)",
+                (version + len(changes), json.dumps(stored))
+            )
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+    def _read(self, since: int) -> Optional[Tuple[int, List[dict]]]:
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                "SELECT v, changes FROM cache_versions WHERE id = 'cache' AND v > ?", (since,)
+            ).fetchone()
+        finally:
+            connection.close()
+        return (row[0], json.loads(row[1])) if row else None
+
+    async def bump(self, changes: List[dict], keep: int = KEEP_CHANGES):
+        await asyncio.to_thread(self._bump, changes, keep)
+
+    async def read(self, since: int) -> Optional[Tuple[int, List[dict]]]:
+        """(version, records) if the version is past since, else None"""
+        return await asyncio.to_thread(self._read, since)
+
+
+class CacheCoherence:
+    """Publishes this worker's cache changes and applies everyone else's
+
+    handlers maps each record kind to a function taking the record's fields;
+    resync is awaited when records were missed and every cache must be
+    rebuilt. Without a store, publish() does nothing.
+    """
+
+    def __init__(self, store, handlers: Dict[str, Callable[..., None]], resync: Callable[[], Awaitable[None]],
+                 interval: float = 0.5, keep: int = KEEP_CHANGES):
+        self.store = store
+        self.handlers = handlers
+        self.resync = resync
+        self.interval = interval
+        self.keep = keep
+        self.worker_id = uuid.uuid4().hex[:12]
+        self.version = 0
+        self._pending: List[dict] = []
+        self._pending_keys = set()
+        self._tasks = []
+        self._watching = False
+        self.published = 0
+        self.applied = 0
+        self.resyncs = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.store is not None
+
+    def publish(self, kind: str, **fields):
+        """Queue a change record for the other workers"""
+        if self.store is None:
+            return
+        # Identical records waiting for the same flush (e.g. "stats") are published once
+        key = (kind, *fields.items())
+        if key in self._pending_keys:
+            return
+        self._pending_keys.add(key)
+        self._pending.append({"k": kind, "w": self.worker_id, **fields})
+
+    async def flush(self):
+        """Publish the queued records in one update of the version document"""
+        changes, self._pending = self._pending, []
+        self._pending_keys = set()
+        if not changes:
+            return
+        try:
+            await self.store.bump(changes, self.keep)
+        except Exception:
+            # Retried by the next flush, ahead of anything queued since
+            self._pending[:0] = changes
+            raise
+        self.published += len(changes)
+
+    async def sync(self):
+        """Apply the records other workers published since the last sync"""
+        result = await self.store.read(self.version)
+        if result is None:
+            return
+        version, changes = result
+        missed = version - self.version
+        self.version = version
+        if missed > len(changes):
+            self.resyncs += 1
+            logger.warning("Missed %d cache changes, rebuilding every cache", missed - len(changes))
+            await self.resync()
+            return
+        for change in changes[len(changes) - missed:]:
+            if change.get("w") == self.worker_id:
+                continue
+            handler = self.handlers.get(change.get("k"))
+            if handler is None:
+                continue
+            fields = {key: value for key, value in change.items() if key not in ("k", "w")}
+            try:
+                handler(**fields)
+                self.applied += 1
+            except Exception:
+                logger.exception("Could not apply cache change %s", change)
+
+    async def start(self):
+        """Skip the history published before this worker started and begin syncing"""
+        if self.store is None or self._tasks:
+            return
+        result = await self.store.read(-1)
+        self.version = result[0] if result else 0
+        self._tasks = [asyncio.create_task(self._publish_loop()), asyncio.create_task(self._sync_loop())]
+        logger.info("Cache coherence enabled for worker %s at version %d", self.worker_id, self.version)
+
+    async def _publish_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Publishing cache changes failed, will retry")
+
+    async def _sync_loop(self):
+        if self.store.can_watch:
+            try:
+                async for _ in self.store.watch():
+                    self._watching = True
+                    await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.info("Change stream unavailable (%s), polling every %.2fs", e, self.interval)
+            self._watching = False
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sync()
+            except Exception:
+                logger.exception("Reading cache changes failed, will retry")
+
+    async def stop(self):
+        """Stop syncing and publish whatever is still queued"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.store is not None:
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Could not publish the last cache changes")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "worker": self.worker_id,
+            "version": self.version,
+            "watching": self._watching,
+            "pending": len(self._pending),
+            "published": self.published,
+            "applied": self.applied,
+            "resyncs": self.resyncs,
+        }
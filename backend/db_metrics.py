@@ -0,0 +1,182 @@
+"""
+MongoDB command instrumentation.
+
+CommandStatsListener receives PyMongo command events from the Motor client
+(mongo_storage.py registers it) without importing PyMongo itself. Motor runs
+PyMongo on executor threads with a copy of the caller's contextvars, so the
+listener can attribute every command to the request that issued it through the current_request context variable, which
+DBStatsMiddleware sets per HTTP request. Commands slower than the configured
+threshold are logged with the shape of their filter (values replaced by "?").
+"""
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from metrics import prometheus_labels
+
+logger = logging.getLogger(__name__)
+
+# Commands whose document is worth describing in the slow query log
+_FILTER_KEYS = ("filter", "query", "q", "pipeline", "updates", "deletes", "documents")
+
+
+class RequestDBStats:
+    __slots__ = ("commands", "seconds", "lock")
+
+    def __init__(self):
+        self.commands = 0
+        self.seconds = 0.0
+        # Commands of one request can complete on several executor threads at once
+        self.lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self.lock:
+            self.commands += 1
+            self.seconds += seconds
+
+
+current_request: ContextVar[Optional[RequestDBStats]] = ContextVar("current_request_db_stats", default=None)
+
+
+def query_shape(value, depth: int = 0):
+    """Replace the values of a filter or pipeline with placeholders, keeping its structure"""
+    if depth > 6:
+        return "?"
+    if isinstance(value, dict):
+        return {key: query_shape(item, depth + 1) for key, item in value.items()}
+    if isinstance(value, list):
+        # Lists of operators (pipelines, $and/$or) keep their shape; lists of values collapse
+        if value and all(isinstance(item, dict) for item in value):
+            return [query_shape(item, depth + 1) for item in value[:10]]
+        return "?"
+    return "?"
+
+
+class CommandStatsListener:
+    def __init__(self, slow_ms: float = 100.0):
+        self.slow_seconds = slow_ms / 1000
+        self.commands = 0
+        self.slow_commands = 0
+        self.failures = 0
+        self._started: Dict[Tuple, Tuple[str, dict]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(event) -> Tuple:
+        return (event.connection_id, event.request_id)
+
+    def started(self, event):
+        if self.slow_seconds <= 0:
+            return
+        # Keep the command until it finishes, in case it turns out to be slow
+        self._started[self._key(event)] = (event.database_name, event.command)
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed: bool):
+        seconds = event.duration_micros / 1_000_000
+        started = self._started.pop(self._key(event), None)
+        with self._lock:
+            self.commands += 1
+            if failed:
+                self.failures += 1
+
+        stats = current_request.get()
+        if stats is not None:
+            stats.add(seconds)
+
+        if self.slow_seconds > 0 and seconds >= self.slow_seconds:
+            with self._lock:
+                self.slow_commands += 1
+            self._log_slow(event, seconds, started, failed)
+
+    def _log_slow(self, event, seconds: float, started, failed: bool):
+        database, command = started if started else (None, {})
+        collection = command.get(event.command_name)
+        shape = {key: query_shape(command[key]) for key in _FILTER_KEYS if key in command}
+        logger.warning(
+            "Slow MongoDB command%s: %s on %s.%s took %.1f ms, shape %s",
+            " (failed)" if failed else "", event.command_name, database, collection, seconds * 1000, shape
+        )
+
+
+class DBStatsRegistry:
+    """Database commands and time accumulated per route"""
+
+    def __init__(self):
+        self.routes: Dict[Tuple[str, str], list] = {}
+
+    def observe(self, method: str, route: str, stats: RequestDBStats):
+        totals = self.routes.get((method, route))
+        if totals is None:
+            totals = self.routes[(method, route)] = [0, 0.0]
+        totals[0] += stats.commands
+        totals[1] += stats.seconds
+
+    def render(self, listener: CommandStatsListener) -> str:
+        lines = [
+            "# HELP db_commands_total MongoDB commands issued per route",
+            "# TYPE db_commands_total counter",
+        ]
+        routes = sorted(self.routes.items())
+        for (method, route), (commands, _) in routes:
+            lines.append(f"db_commands_total{prometheus_labels(method, route)} {commands}")
+        lines += [
+            "# HELP db_command_seconds_total Time spent in MongoDB commands per route",
+            "# TYPE db_command_seconds_total counter",
+        ]
+        for (method, route), (_, seconds) in routes:
+            lines.append(f"db_command_seconds_total{prometheus_labels(method, route)} {seconds}")
+        lines += [
+            "# HELP db_slow_commands_total MongoDB commands over the slow query threshold",
+            "# TYPE db_slow_commands_total counter",
+            f"db_slow_commands_total {listener.slow_commands}",
+            "# HELP db_command_failures_total MongoDB commands that failed",
+            "# TYPE db_command_failures_total counter",
+            f"db_command_failures_total {listener.failures}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class DBStatsMiddleware:
+    """Pure ASGI middleware giving each request its own RequestDBStats
+
+    Totals are attributed to the route template once the request finishes. With
+    debug enabled, the response carries X-DB-Calls and X-DB-Time-Ms headers
+    counting the commands issued before the response started.
+    """
+
+    def __init__(self, app, registry: DBStatsRegistry, route_template, debug: bool = False):
+        self.app = app
+        self.registry = registry
+        self.route_template = route_template
+        self.debug = debug
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestDBStats()
+        token = current_request.set(stats)
+        wrapped_send = send
+
+        if self.debug:
+            async def wrapped_send(message):
+                if message["type"] == "http.response.start":
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-db-calls", str(stats.commands).encode()))
+                    headers.append((b"x-db-time-ms", f"{stats.seconds * 1000:.2f}".encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+        try:
+            await self.app(scope, receive, wrapped_send)
+        finally:
+            current_request.reset(token)
+            self.registry.observe(scope["method"], self.route_template(scope), stats)
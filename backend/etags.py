@@ -0,0 +1,82 @@
+"""
+Weak ETags for read endpoints, derived from in-process version counters.
+
+Writes bump the counter of every resource they change; a read's ETag is built
+from the counters before any database work, so a matching If-None-Match can
+be answered with 304 straight away. Counters are per process and start from
+a random epoch, so validators from another worker or an earlier run never
+match by accident; with cache coherence enabled, writes handled by other
+workers bump them too. Without it, set max_age: tags then also change every
+max_age seconds, so a worker that handles no writes still stops answering
+304 to content another worker has since changed.
+"""
+import time
+import uuid
+import zlib
+from typing import Optional
+
+from fastapi import Request, Response
+
+# Per-player counters are hashed into a fixed number of slots to bound memory;
+# players sharing a slot only cost each other an occasional full response
+PLAYER_SLOTS = 4096
+
+
+class VersionCounters:
+    def __init__(self, player_slots: int = PLAYER_SLOTS, max_age: Optional[float] = None):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.max_age = max_age
+        self._versions = {}
+        self._player_versions = [0] * player_slots
+        self.not_modified = 0
+
+    def reset(self):
+        """Start a new epoch, so no validator handed out so far matches again"""
+        self.epoch = uuid.uuid4().hex[:8]
+
+    def bump(self, resource: str):
+        self._versions[resource] = self._versions.get(resource, 0) + 1
+
+    def bump_player(self, player_name: str):
+        self._player_versions[self._slot(player_name)] += 1
+
+    def _slot(self, player_name: str) -> int:
+        return zlib.crc32(player_name.encode()) % len(self._player_versions)
+
+    def etag(self, resource: str, player_name: Optional[str] = None, *extra) -> str:
+        """Weak ETag for a resource, optionally scoped to a player"""
+        parts = [self.epoch, str(self._versions.get(resource, 0))]
+        if player_name is not None:
+            parts.append(str(self._player_versions[self._slot(player_name)]))
+        parts.extend(str(part) for part in extra)
+        if self.max_age:
+            parts.append(str(int(time.time() // self.max_age)))
+        return f'W/"{resource}-{"-".join(parts)}"'
+
+    def check(self, request: Request, response: Response, etag: str) -> Optional[Response]:
+        """Return a 304 if the client already has etag, else set it on the response"""
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+        return None
+
+    def stats(self) -> dict:
+        return {"not_modified": self.not_modified, "resources": dict(self._versions)}
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
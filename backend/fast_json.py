@@ -0,0 +1,22 @@
+"""
+JSON responses encoded with orjson, bypassing response_model validation.
+
+Hot endpoints build their bodies from documents and models they created
+themselves, so re-validating them through the declared response_model (kept
+for the OpenAPI schema) and encoding them with the stdlib is wasted work.
+"""
+from typing import Optional
+
+import orjson
+from fastapi import Response
+
+
+def dumps(content) -> bytes:
+    """Encode plain data (dicts, lists, datetimes) to JSON bytes"""
+    return orjson.dumps(content)
+
+
+def json_response(body: bytes, response: Optional[Response] = None) -> Response:
+    """Response for an already encoded body, keeping headers set on the injected response"""
+    headers = dict(response.headers) if response is not None else None
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -1,150 +1,645 @@
-from fastapi import APIRouter, HTTPException
-from motor.motor_asyncio import AsyncIOMotorDatabase
-from typing import List
+from fastapi import APIRouter, Body, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from typing import Any, List, Literal, Optional
 from datetime import datetime
+import asyncio
+import json
+import logging
 import os
+import time
 
 from models import (
     GameScore, GameScoreCreate, ScoreResponse, LeaderboardEntry, GameStats,
+    LeaderboardPage, PlayerRank, PlayerProfile,
+    BatchScoreResult, BatchScoreResponse,
     GameSession, GameSessionCreate, GameSessionUpdate, 
-    Achievement, PlayerAchievement, AchievementUnlock, AchievementWithStatus
+    AchievementUnlock, AchievementWithStatus, RecentUnlocks
 )
-from achievements import ACHIEVEMENTS, get_achievements_for_height, get_completion_achievements
+from achievements import ACHIEVEMENTS, ACHIEVEMENT_BITS, get_achievements_for_height, get_unlockable_achievements, next_height_threshold
+from cache import LeaderboardCache, UnlockCache
+from leaderboard_stream import LeaderboardBroadcaster
+from ranking import RankIndex, decode_cursor, rank_key
+from periods import WINDOWS, period_buckets, period_key
+from etags import VersionCounters
+from coherence import CacheCoherence, SqliteVersionStore
+from rate_limit import AdmissionControl, RouteLimit, WriteGate, parse_rate
+from fast_json import dumps, json_response
+from achievement_worker import AchievementWorker
+from session_buffer import SessionWriteBuffer
+from settings import env_flag
 
-# Get database from environment
-from server import db
+# Storage backend chosen at startup
+from server import repository
+
+logger = logging.getLogger(__name__)
 
 game_router = APIRouter(prefix="/api")
 
+# Largest batch accepted by /api/scores/batch
+MAX_SCORE_BATCH = 500
+
+# Versions of the cacheable read endpoints, bumped by the writes below
+versions = VersionCounters()
+
+# The achievement catalog with nothing unlocked, built once; per-player status is layered on top
+LOCKED_CATALOG = [
+    AchievementWithStatus(
+        id=achievement["id"],
+        name=achievement["name"],
+        description=achievement["description"],
+        icon=achievement["icon"]
+    ).model_dump()
+    for achievement in ACHIEVEMENTS
+]
+LOCKED_CATALOG_BODY = dumps(LOCKED_CATALOG)
+
+# Longest a worker serves cached content without a write of its own telling it otherwise
+CACHE_TTL = float(os.environ.get("LEADERBOARD_CACHE_TTL", "30"))
+
+# Each player's unlocked achievements, dropped when they unlock more
+unlock_cache = UnlockCache(
+    max_players=int(os.environ.get("UNLOCK_CACHE_PLAYERS", "10000")),
+    max_bytes=int(float(os.environ.get("UNLOCK_CACHE_MB", "16")) * 1024 * 1024),
+    ttl=float(os.environ.get("UNLOCK_CACHE_TTL", CACHE_TTL))
+)
+
+# Encoded /api/stats body, the ETag it was built for and when it expires
+stats_body = [None, b"", 0.0]
+
+# Largest leaderboard slice returned by one request
+MAX_LEADERBOARD_PAGE = 100
+
+# Every player's rank, kept current by record_player_scores
+rank_index = RankIndex()
+
+# In-process leaderboard snapshots, invalidated by save_score
+leaderboard_cache = LeaderboardCache(ttl=CACHE_TTL)
+
+# Day, week and month boards, each snapshot tied to the period it was loaded for
+window_caches = {
+    window: LeaderboardCache(ttl=float(os.environ.get("WINDOW_LEADERBOARD_CACHE_TTL", "5")))
+    for window in WINDOWS
+}
+
+# Top of the leaderboard shared by every /api/leaderboard/stream client
+leaderboard_stream = LeaderboardBroadcaster(
+    lambda limit: leaderboard_cache.get(limit, load_leaderboard),
+    size=int(os.environ.get("LEADERBOARD_STREAM_SIZE", "10"))
+)
+
+# Optional write-behind for session progress updates
+session_buffer = SessionWriteBuffer(
+    repository,
+    enabled=env_flag("SESSION_WRITE_BEHIND"),
+    flush_interval=float(os.environ.get("SESSION_FLUSH_INTERVAL", "1.0")),
+    max_size=int(os.environ.get("SESSION_BUFFER_SIZE", "1000")),
+    on_flush=lambda: cache_changed("stats")
+)
+
+# Write endpoints with their own token buckets. RATE_LIMIT_<ROUTE> limits each player (or
+# session) and RATE_LIMIT_<ROUTE>_IP each client IP, as "rate:burst" in requests per second,
+# e.g. RATE_LIMIT_SCORES=1:5; unset means unlimited. Batches spend one token per score, from
+# the client's scores_batch bucket and from each player's scores bucket. The session
+# WebSocket's writes go through the same session and score limits as the endpoints
+RATE_LIMITED_ROUTES = ("scores", "scores_batch", "session_start", "session_update", "achievements_unlock")
+
+# MAX_CONCURRENT_WRITES caps database-bound writes in flight; beyond it writes get 429
+admission = AdmissionControl(
+    {
+        route: RouteLimit(
+            parse_rate(os.environ.get(f"RATE_LIMIT_{route.upper()}")),
+            parse_rate(os.environ.get(f"RATE_LIMIT_{route.upper()}_IP")),
+            max_keys=int(os.environ.get("RATE_LIMIT_MAX_KEYS", "100000"))
+        )
+        for route in RATE_LIMITED_ROUTES
+    },
+    WriteGate(int(os.environ.get("MAX_CONCURRENT_WRITES", "0"))),
+    trust_forwarded_for=env_flag("TRUST_FORWARDED_FOR")
+)
+
+# Counters of the live session WebSocket
+socket_stats = {"connections": 0, "messages": 0, "writes": 0}
+
 # Score endpoints
 @game_router.post("/scores", response_model=ScoreResponse)
-async def save_score(score_data: GameScoreCreate):
+async def save_score(score_data: GameScoreCreate, request: Request = None):
     """Save a game score"""
-    try:
-        # Create score object
-        score = GameScore(**score_data.dict())
-        
-        # Insert into database
-        await db.game_scores.insert_one(score.dict())
-        
-        # Check if it's a new personal record
-        existing_scores = await db.game_scores.find({
-            "player_name": score.player_name
-        }).sort("height", -1).limit(1).to_list(1)
-        
-        new_record = not existing_scores or score.height > existing_scores[0]["height"]
-        
-        # Check for achievement unlocks
-        await check_and_unlock_achievements(score.player_name, score.height, score.completed, score.completion_time)
-        
-        return ScoreResponse(
-            success=True,
-            score_id=score.id,
-            new_record=new_record
-        )
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    with admission.admit("scores", request, score_data.player_name):
+        try:
+            response, _ = await store_score(score_data)
+            return json_response(dumps(response.model_dump()))
+            
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+async def store_score(score_data: GameScoreCreate, inline: bool = False):
+    """Store a score and evaluate its achievements
+    
+    Returns the ScoreResponse and the achievements unlocked, which are only
+    known when the evaluation ran inline rather than on the background worker.
+    """
+    # Create score object; the input is already validated, so only the defaults are filled in
+    score = GameScore.model_construct(**dict(score_data))
+    
+    # Insert into database
+    await repository.insert_score(score.model_dump())
+    
+    # Update the player's materialized stats, getting the previous best back
+    previous, (new_record,) = await record_player_scores(score.player_name, [score])
+    
+    # Fold the score into the global counters behind /api/stats
+    await increment_game_stats([score])
+    
+    # Check for achievement unlocks
+    # The counters come from the stats write above, so no extra reads are needed for them
+    counters = {
+        "games_played": previous.get("games_played", 0) + 1,
+        "completions": previous.get("completions", 0) + (1 if score.completed else 0)
+    }
+    job = {
+        "height": score.height,
+        "completed": score.completed,
+        "completion_time": score.completion_time,
+        "counters": counters
+    }
+    # Hand the evaluation to the background worker when enabled, else run it inline
+    unlocked = []
+    if inline or not achievement_worker.submit(score.player_name, **job):
+        unlocked = await achievement_worker.run_inline(score.player_name, **job)
+    
+    response = ScoreResponse(
+        success=True,
+        score_id=score.id,
+        new_record=new_record
+    )
+    return response, unlocked
+
+@game_router.post("/scores/batch", response_model=BatchScoreResponse)
+async def save_scores_batch(batch: List[Any] = Body(...), request: Request = None):
+    """Save a batch of game scores, e.g. queued offline or imported from a tournament
+    
+    Items are validated one by one, so an invalid item is reported in its
+    result instead of rejecting the whole batch.
+    """
+    if len(batch) > MAX_SCORE_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_SCORE_BATCH} scores per batch")
+    
+    results = [BatchScoreResult(index=index, success=False) for index in range(len(batch))]
+    valid = []
+    for result, item in zip(results, batch):
+        try:
+            valid.append((GameScore.model_construct(**dict(GameScoreCreate.model_validate(item))), result))
+        except ValidationError as e:
+            result.error = "; ".join(
+                f"{'.'.join(str(part) for part in error['loc']) or 'item'}: {error['msg']}" for error in e.errors()
+            )
+    
+    # Players in the batch spend from the same buckets as their single score submissions
+    player_costs = {}
+    for score, _ in valid:
+        player_costs[score.player_name] = player_costs.get(score.player_name, 0) + 1
+    
+    with admission.admit(
+        "scores_batch", request, cost=max(1, len(batch)), player_route="scores", player_costs=player_costs
+    ):
+        try:
+            scores = [score for score, _ in valid]
+            results_by_score = [result for _, result in valid]
+            for score, result in valid:
+                result.success = True
+                result.score_id = score.id
+            
+            # One unordered insert; items that fail are reported, the rest still go in
+            failures = await repository.insert_scores([score.model_dump() for score in scores]) if scores else {}
+            for index, error in failures.items():
+                result = results_by_score[index]
+                result.success = False
+                result.score_id = None
+                result.error = error
+            
+            # Group the stored scores by player, keeping submission order
+            by_player = {}
+            for score, result in valid:
+                if result.success:
+                    by_player.setdefault(score.player_name, []).append((score, result))
+            
+            async def record_player(player_name, items):
+                player_scores = [score for score, _ in items]
+                previous, new_records = await record_player_scores(player_name, player_scores)
+                earned = await check_batch_achievements(player_name, player_scores, previous)
+                for (score, result), new_record in zip(items, new_records):
+                    result.new_record = new_record
+                    result.achievements = earned.get(score.id, [])
+            
+            await asyncio.gather(*(record_player(name, items) for name, items in by_player.items()))
+            
+            stored = [score for score, result in valid if result.success]
+            if stored:
+                await increment_game_stats(stored)
+            
+            return BatchScoreResponse(
+                saved=len(stored),
+                failed=len(batch) - len(stored),
+                results=results
+            )
+            
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 @game_router.get("/leaderboard", response_model=List[LeaderboardEntry])
-async def get_leaderboard(limit: int = 10):
-    """Get leaderboard with top scores"""
+async def get_leaderboard(
+    request: Request,
+    response: Response,
+    limit: int = Query(10, ge=1, le=MAX_LEADERBOARD_PAGE),
+    window: Optional[Literal["day", "week", "month"]] = None
+):
+    """Get leaderboard with top scores, all-time or for the current day, week or month"""
+    if window is None:
+        etag = versions.etag("leaderboard")
+    else:
+        # The period is part of the tag, so a new day or week changes it without a write
+        period = period_key(window, datetime.utcnow())
+        etag = versions.etag("leaderboard_window", None, period)
+    not_modified = versions.check(request, response, etag)
+    if not_modified:
+        return not_modified
+    
     try:
-        # Aggregate top scores by player
-        pipeline = [
-            {
-                "$group": {
-                    "_id": "$player_name",
-                    "max_height": {"$max": "$height"},
-                    "completions": {"$sum": {"$cond": ["$completed", 1, 0]}},
-                    "best_time": {"$min": {"$cond": ["$completed", "$completion_time", None]}},
-                    "score_id": {"$first": "$id"}
-                }
-            },
-            {"$sort": {"max_height": -1, "completions": -1}},
-            {"$limit": limit}
-        ]
-        
-        results = await db.game_scores.aggregate(pipeline).to_list(limit)
-        
-        leaderboard = []
-        for result in results:
-            leaderboard.append(LeaderboardEntry(
-                id=result["score_id"],
-                name=result["_id"],
-                height=result["max_height"],
-                completions=result["completions"],
-                best_time=result["best_time"]
-            ))
-        
-        return leaderboard
+        if window is not None:
+            body = await window_caches[window].get_body(
+                limit, lambda limit: load_window_leaderboard(period, limit), period
+            )
+        else:
+            body = await leaderboard_cache.get_body(limit, load_leaderboard)
+        return json_response(body, response)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@game_router.get("/leaderboard/stream")
+async def stream_leaderboard(request: Request):
+    """Server-Sent Events: the top of the leaderboard, then a diff whenever it changes"""
+    async def events():
+        stream = leaderboard_stream.stream()
+        try:
+            async for event in stream:
+                if await request.is_disconnected():
+                    break
+                yield event
+        finally:
+            # Unsubscribes now rather than whenever the generator is collected
+            await stream.aclose()
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@game_router.get("/leaderboard/page", response_model=LeaderboardPage)
+async def get_leaderboard_page(cursor: Optional[str] = None, limit: int = Query(10, ge=1, le=MAX_LEADERBOARD_PAGE)):
+    """Page through the whole leaderboard; pass back next_cursor to get the following page"""
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    entries, next_cursor = rank_index.page(after, limit)
+    return LeaderboardPage(entries=entries, next_cursor=next_cursor, total_players=len(rank_index))
+
+@game_router.get("/leaderboard/rank/{player_name}", response_model=PlayerRank)
+async def get_player_rank(player_name: str, radius: int = Query(5, ge=0, le=MAX_LEADERBOARD_PAGE // 2)):
+    """A player's rank and the entries around them"""
+    rank, entries = rank_index.around(player_name, radius)
+    if rank is None:
+        raise HTTPException(status_code=404, detail="Player not found")
+    
+    return PlayerRank(player_name=player_name, rank=rank, total_players=len(rank_index), entries=entries)
+
+async def load_rank_index():
+    """Rebuild the rank index from every player's stats and swap it in"""
+    global rank_index
+    fresh = RankIndex()
+    await fresh.load(repository.scan_player_stats())
+    # Submissions handled during the scan may be missing from it; stats only grow,
+    # so keep whichever standing is further ahead
+    for entry in rank_index.slice(0, len(rank_index)):
+        loaded = fresh.key_of(entry["name"])
+        if loaded is None or rank_key(entry["name"], entry["height"], entry["completions"]) < loaded:
+            fresh.update(entry["name"], entry["height"], entry["completions"], id=entry["id"], best_time=entry["best_time"])
+    rank_index = fresh
+    versions.bump("leaderboard")
+
+# The rank index is kept current by this worker's own submissions. Several workers without
+# cache coherence can opt in to rebuilding it every RANK_INDEX_REFRESH_SECONDS to pick up
+# each other's; a rebuild rescans every player's stats, so it is off (0) by default
+RANK_INDEX_REFRESH_SECONDS = float(os.environ.get("RANK_INDEX_REFRESH_SECONDS", "0"))
+rank_index_refresh: Optional[asyncio.Task] = None
+
+async def refresh_rank_index():
+    while True:
+        await asyncio.sleep(RANK_INDEX_REFRESH_SECONDS)
+        try:
+            await load_rank_index()
+        except Exception:
+            logger.exception("Rebuilding the rank index failed, will retry")
+
+def start_rank_index_refresh():
+    """Rebuild the rank index periodically unless cache coherence keeps it current"""
+    global rank_index_refresh
+    if cache_coherence.enabled or RANK_INDEX_REFRESH_SECONDS <= 0 or rank_index_refresh is not None:
+        return
+    rank_index_refresh = asyncio.create_task(refresh_rank_index())
+
+async def stop_rank_index_refresh():
+    global rank_index_refresh
+    if rank_index_refresh is None:
+        return
+    rank_index_refresh.cancel()
+    await asyncio.gather(rank_index_refresh, return_exceptions=True)
+    rank_index_refresh = None
+
+async def load_leaderboard(limit: int) -> List[LeaderboardEntry]:
+    """Read the top players straight from the materialized per-player stats"""
+    return leaderboard_entries(await repository.top_players(limit))
+
+async def load_window_leaderboard(period: str, limit: int) -> List[LeaderboardEntry]:
+    """Read the top players of a period's bucket"""
+    return leaderboard_entries(await repository.top_period_players(period, limit))
+
+def leaderboard_entries(results: List[dict]) -> List[LeaderboardEntry]:
+    """Build leaderboard entries from stats documents in leaderboard order"""
+    leaderboard = []
+    for result in results:
+        leaderboard.append(LeaderboardEntry(
+            id=result["id"],
+            name=result["player_name"],
+            height=result["height"],
+            completions=result["completions"],
+            best_time=result.get("best_time")
+        ))
+    
+    return leaderboard
+
+@game_router.get("/cache/stats")
+async def get_cache_stats():
+    """Report hit, miss and refresh counts of the in-process caches and queues"""
+    return {
+        "leaderboard": leaderboard_cache.stats(),
+        "unlocks": unlock_cache.stats(),
+        "window_leaderboards": {window: cache.stats() for window, cache in window_caches.items()},
+        "achievement_worker": achievement_worker.stats(),
+        "session_buffer": session_buffer.stats(),
+        "session_socket": dict(socket_stats),
+        "leaderboard_stream": leaderboard_stream.stats(),
+        "etags": versions.stats(),
+        "admission": admission.stats(),
+        "coherence": cache_coherence.stats()
+    }
+
 @game_router.get("/stats", response_model=GameStats)
-async def get_game_stats():
+async def get_game_stats(request: Request, response: Response):
     """Get global game statistics"""
+    etag = versions.etag("stats")
+    not_modified = versions.check(request, response, etag)
+    if not_modified:
+        return not_modified
+    
+    # Reuse the encoded body until a write bumps the stats version or it expires
+    if stats_body[0] == etag and stats_body[2] > time.monotonic():
+        return json_response(stats_body[1], response)
+    
     try:
-        # Count total plays
-        total_plays = await db.game_scores.count_documents({})
-        
-        # Calculate average height
-        avg_pipeline = [
-            {"$group": {"_id": None, "avg_height": {"$avg": "$height"}}}
-        ]
-        avg_result = await db.game_scores.aggregate(avg_pipeline).to_list(1)
-        average_height = round(avg_result[0]["avg_height"], 1) if avg_result else 0
+        # Read the incrementally maintained global counters
+        counters = await repository.get_game_stats()
         
-        # Calculate completion rate
-        completions = await db.game_scores.count_documents({"completed": True})
-        completion_rate = round((completions / total_plays * 100), 1) if total_plays > 0 else 0
+        total_plays = counters.get("total_plays", 0)
+        average_height = round(counters.get("height_sum", 0) / total_plays, 1) if total_plays > 0 else 0
+        completion_rate = round((counters.get("completions", 0) / total_plays * 100), 1) if total_plays > 0 else 0
         
-        # Calculate total play time (estimated)
-        total_seconds = total_plays * 120  # Estimate 2 minutes per game
+        # Total play time summed from the game sessions
+        total_seconds = counters.get("play_time", 0)
         hours = total_seconds // 3600
         minutes = (total_seconds % 3600) // 60
         total_play_time = f"{hours}h {minutes}m"
         
-        return GameStats(
+        body = dumps(GameStats(
             total_plays=total_plays,
             average_height=average_height,
             completion_rate=completion_rate,
             total_play_time=total_play_time
-        )
+        ).model_dump())
+        stats_body[:] = [etag, body, time.monotonic() + CACHE_TTL]
+        return json_response(body, response)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Session endpoints
 @game_router.post("/session/start")
-async def start_game_session(session_data: GameSessionCreate):
+async def start_game_session(session_data: GameSessionCreate, request: Request = None):
     """Start a new game session"""
-    try:
-        session = GameSession(**session_data.dict())
-        await db.game_sessions.insert_one(session.dict())
-        
-        return {"session_id": session.id}
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    with admission.admit("session_start", request, session_data.player_name):
+        try:
+            session = GameSession.model_construct(**dict(session_data))
+            await repository.insert_session(session.model_dump())
+            
+            return {"session_id": session.id}
+            
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 @game_router.put("/session/{session_id}")
-async def update_game_session(session_id: str, update_data: GameSessionUpdate):
+async def update_game_session(session_id: str, update_data: GameSessionUpdate, request: Request = None):
     """Update game session progress"""
+    # Sessions belong to one player, so the session stands in for them
+    with admission.admit("session_update", request, session_id):
+        try:
+            if not await write_session_progress(session_id, update_data):
+                raise HTTPException(status_code=404, detail="Session not found")
+            
+            return {"success": True}
+            
+        except HTTPException:
+            # Re-raise HTTPExceptions as-is
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+async def write_session_progress(session_id: str, update_data: GameSessionUpdate) -> bool:
+    """Store a session's progress; False if the session does not exist"""
+    update_dict = update_data.model_dump()
+    update_dict["end_time"] = datetime.utcnow()
+    
+    if session_buffer.enabled:
+        # Coalesced in memory and written by the next flush
+        return await session_buffer.update(session_id, update_dict)
+    
+    previous = await repository.update_session(session_id, update_dict)
+    
+    if previous is None:
+        return False
+    
+    # Add only the play time this update contributed to the global counter
+    play_time_delta = update_data.play_time - previous.get("play_time", 0)
+    if play_time_delta:
+        await repository.increment_game_stats(play_time=play_time_delta)
+        cache_changed("stats")
+    
+    return True
+
+@game_router.websocket("/ws/session")
+async def session_socket(websocket: WebSocket):
+    """Live game session over one connection
+    
+    Client messages:
+        {"type": "start", "player_name": "..."}
+        {"type": "progress", "height": 42, "play_time": 17}
+        {"type": "finish", "height": 300, "completed": true, "play_time": 250}
+    
+    Progress is kept in the connection and only stored when the player reaches a
+    new height achievement threshold; those achievements are pushed back as
+    {"type": "achievement", ...} messages. Finishing stores the session and the
+    score and replies with {"type": "finished", ...}.
+    """
+    await websocket.accept()
+    socket_stats["connections"] += 1
+    live = LiveSession(websocket)
     try:
-        update_dict = update_data.dict()
-        update_dict["end_time"] = datetime.utcnow()
-        
-        result = await db.game_sessions.update_one(
-            {"id": session_id},
-            {"$set": update_dict}
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                handler = SESSION_SOCKET_HANDLERS[message["type"]]
+            except (ValueError, KeyError, TypeError):
+                await websocket.send_json({"type": "error", "detail": "Unknown or malformed message"})
+                continue
+            
+            socket_stats["messages"] += 1
+            try:
+                for reply in await handler(live, message):
+                    await websocket.send_json(reply)
+            except (ValidationError, ValueError) as e:
+                await websocket.send_json({"type": "error", "detail": str(e)})
+            except HTTPException as e:
+                # Refused by admission control; the client retries after retry_after seconds
+                reply = {"type": "error", "detail": e.detail}
+                if e.headers and "Retry-After" in e.headers:
+                    reply["retry_after"] = int(e.headers["Retry-After"])
+                await websocket.send_json(reply)
+            except WebSocketDisconnect:
+                raise
+            except Exception:
+                # A storage failure fails this message, not the whole connection
+                logger.exception("Session socket %s message failed", message["type"])
+                await websocket.send_json({"type": "error", "detail": "Internal error, try again"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        socket_stats["connections"] -= 1
+
+def message_fields(message: dict, *keys) -> dict:
+    """The given keys of a client message, leaving out absent and null ones so defaults and validation apply"""
+    return {key: message[key] for key in keys if message.get(key) is not None}
+
+class LiveSession:
+    """Per-connection state of a WebSocket game session"""
+    __slots__ = ("websocket", "session_id", "player_name", "height", "play_time", "next_threshold", "unlocked_ids")
+    
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.session_id = None
+        self.player_name = None
+        self.height = 0
+        self.play_time = 0
+        self.next_threshold = None
+        self.unlocked_ids = None
+
+async def socket_start(live: LiveSession, message: dict):
+    session_data = GameSessionCreate(player_name=message.get("player_name"))
+    session = GameSession.model_construct(**dict(session_data))
+    with admission.admit("session_start", live.websocket, session.player_name):
+        await repository.insert_session(session.model_dump())
+    
+    live.session_id = session.id
+    live.player_name = session.player_name
+    live.height = live.play_time = 0
+    live.next_threshold = next_height_threshold(0)
+    live.unlocked_ids = await get_unlocked_ids(live.player_name) if live.player_name else set()
+    socket_stats["writes"] += 1
+    return [{"type": "started", "session_id": session.id}]
+
+async def socket_progress(live: LiveSession, message: dict):
+    if live.session_id is None:
+        raise ValueError("Send a start message first")
+    
+    update = GameSessionUpdate(**{"play_time": live.play_time, **message_fields(message, "height", "play_time")})
+    live.height = max(live.height, update.height)
+    live.play_time = update.play_time
+    
+    # Nothing worth storing until the player crosses the next height threshold
+    if live.next_threshold is None or live.height < live.next_threshold:
+        return []
+    
+    with admission.admit("session_update", live.websocket, live.session_id):
+        await write_session_progress(live.session_id, GameSessionUpdate(height=live.height, play_time=live.play_time))
+    # Advanced only once stored, so a failed write is retried by the next progress message
+    live.next_threshold = next_height_threshold(live.height)
+    socket_stats["writes"] += 1
+    
+    replies = []
+    if live.player_name:
+        earned = [a for a in get_achievements_for_height(live.height) if a["id"] not in live.unlocked_ids]
+        unlocked = await unlock_player_achievements(live.player_name, earned)
+        live.unlocked_ids.update(a["id"] for a in earned)
+        replies = [{"type": "achievement", "achievement": achievement} for achievement in unlocked]
+    return replies
+
+async def socket_finish(live: LiveSession, message: dict):
+    if live.session_id is None:
+        raise ValueError("Send a start message first")
+    
+    update = GameSessionUpdate(**{"play_time": live.play_time, **message_fields(message, "height", "completed", "play_time")})
+    # Storing the session again is harmless, so a finish refused at the score can simply be resent
+    with admission.admit("session_update", live.websocket, live.session_id):
+        await write_session_progress(live.session_id, update)
+    socket_stats["writes"] += 1
+    
+    reply = {"type": "finished", "session_id": live.session_id, "score_id": None, "new_record": False}
+    replies = []
+    if live.player_name:
+        score_data = GameScoreCreate(
+            player_name=live.player_name,
+            height=update.height,
+            completed=update.completed,
+            completion_time=message_fields(message, "completion_time").get(
+                "completion_time", update.play_time if update.completed else None
+            )
         )
+        with admission.admit("scores", live.websocket, live.player_name):
+            response, unlocked = await store_score(score_data, inline=True)
+        reply.update(score_id=response.score_id, new_record=response.new_record)
+        replies = [{"type": "achievement", "achievement": achievement} for achievement in unlocked]
+    
+    live.session_id = None
+    return replies + [reply]
+
+SESSION_SOCKET_HANDLERS = {
+    "start": socket_start,
+    "progress": socket_progress,
+    "finish": socket_finish,
+}
+
+@game_router.get("/session/{session_id}")
+async def get_game_session(session_id: str):
+    """Get a game session, including progress not yet flushed to storage"""
+    try:
+        session = await session_buffer.get(session_id)
         
-        if result.matched_count == 0:
+        if session is None:
             raise HTTPException(status_code=404, detail="Session not found")
         
-        return {"success": True}
+        return session
         
     except HTTPException:
         # Re-raise HTTPExceptions as-is
@@ -154,124 +649,313 @@ async def update_game_session(session_id: str, update_data: GameSessionUpdate):
 
 # Achievement endpoints
 @game_router.get("/achievements/{player_name}", response_model=List[AchievementWithStatus])
-async def get_player_achievements(player_name: str):
+async def get_player_achievements(player_name: str, request: Request, response: Response):
     """Get all achievements with unlock status for a player"""
+    not_modified = versions.check(request, response, versions.etag("achievements", player_name))
+    if not_modified:
+        return not_modified
+    
     try:
         # Get player's unlocked achievements
-        unlocked = await db.player_achievements.find({"player_name": player_name}).to_list(100)
-        unlocked_ids = {a["achievement_id"]: a["unlocked_at"] for a in unlocked}
-        
-        # Return all achievements with status
-        achievements = []
-        for achievement in ACHIEVEMENTS:
-            is_unlocked = achievement["id"] in unlocked_ids
-            achievements.append(AchievementWithStatus(
-                id=achievement["id"],
-                name=achievement["name"],
-                description=achievement["description"],
-                icon=achievement["icon"],
-                unlocked=is_unlocked,
-                unlocked_at=unlocked_ids.get(achievement["id"])
-            ))
+        unlocks = await get_unlocks(player_name)
         
-        return achievements
+        # Return all achievements with status; players without unlocks share one body
+        if not unlocks:
+            return json_response(LOCKED_CATALOG_BODY, response)
+        return json_response(dumps(achievements_with_status(unlocks)), response)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@game_router.post("/achievements/unlock")
-async def unlock_achievement(unlock_data: AchievementUnlock):
-    """Manually unlock an achievement"""
+def achievements_with_status(unlocks: dict) -> List[dict]:
+    """The whole catalog with each achievement's unlock status, from a map of id to unlock time"""
+    return [
+        {**entry, "unlocked": True, "unlocked_at": unlocks[entry["id"]]} if entry["id"] in unlocks else entry
+        for entry in LOCKED_CATALOG
+    ]
+
+# Player endpoints
+@game_router.get("/players/{player_name}/profile", response_model=PlayerProfile)
+async def get_player_profile(player_name: str):
+    """Everything the game screen shows about a player in one request
+    
+    Stats and unlocks are two reads issued together, and the rank comes from the
+    in-process rank index, so the profile costs at most two concurrent round trips.
+    """
     try:
-        # Check if already unlocked
-        existing = await db.player_achievements.find_one({
-            "player_name": unlock_data.player_name,
-            "achievement_id": unlock_data.achievement_id
-        })
-        
-        if existing:
-            return {"success": False, "message": "Achievement already unlocked"}
-        
-        # Unlock achievement
-        player_achievement = PlayerAchievement(
-            player_name=unlock_data.player_name,
-            achievement_id=unlock_data.achievement_id
+        stats, unlocks = await asyncio.gather(
+            repository.get_player_stats(player_name),
+            get_unlocks(player_name)
         )
-        
-        await db.player_achievements.insert_one(player_achievement.dict())
-        
-        # Find achievement details
-        achievement = next(
-            (a for a in ACHIEVEMENTS if a["id"] == unlock_data.achievement_id), 
-            None
+        stats = stats or {}
+        
+        return PlayerProfile(
+            player_name=player_name,
+            best_height=stats.get("height", 0),
+            completions=stats.get("completions", 0),
+            best_time=stats.get("best_time"),
+            games_played=stats.get("games_played", 0),
+            rank=rank_index.rank(player_name),
+            total_players=len(rank_index),
+            achievements=achievements_with_status(unlocks)
         )
         
-        return {
-            "success": True, 
-            "achievement": achievement
-        }
-        
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@game_router.get("/achievements/{player_name}/recent", response_model=RecentUnlocks)
+async def get_recent_unlocks(player_name: str):
+    """Get a player's pending achievement evaluations and most recent unlocks"""
+    pending, recent = achievement_worker.recent(player_name)
+    return RecentUnlocks(
+        player_name=player_name,
+        pending=pending,
+        unlocks=[
+            AchievementWithStatus(
+                id=achievement["id"],
+                name=achievement["name"],
+                description=achievement["description"],
+                icon=achievement["icon"],
+                unlocked=True,
+                unlocked_at=unlocked_at
+            )
+            for achievement, unlocked_at in recent
+        ]
+    )
+
+@game_router.post("/achievements/unlock")
+async def unlock_achievement(unlock_data: AchievementUnlock, request: Request = None):
+    """Manually unlock an achievement"""
+    # Only catalog achievements have a bit to store
+    if unlock_data.achievement_id not in ACHIEVEMENT_BITS:
+        raise HTTPException(status_code=404, detail="Achievement not found")
+    
+    with admission.admit("achievements_unlock", request, unlock_data.player_name):
+        try:
+            # Idempotent unlock; nothing created means it was already unlocked
+            created = await repository.add_unlocks(unlock_data.player_name, [unlock_data.achievement_id])
+            if created:
+                cache_changed("unlocks", player_name=unlock_data.player_name)
+            
+            if not created:
+                return {"success": False, "message": "Achievement already unlocked"}
+            
+            # Find achievement details
+            achievement = next(
+                (a for a in ACHIEVEMENTS if a["id"] == unlock_data.achievement_id), 
+                None
+            )
+            
+            return {
+                "success": True, 
+                "achievement": achievement
+            }
+            
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
 # Helper function for achievement checking
-async def check_and_unlock_achievements(player_name: str, height: int, completed: bool, completion_time: int = None):
-    """Check and unlock achievements based on game performance"""
+async def check_and_unlock_achievements(player_name: str, height: int, completed: bool, completion_time: int = None, counters: dict = None):
+    """Check and unlock achievements based on game performance
+    
+    Errors propagate so the achievement worker can count and log them.
+    """
+    if counters is None:
+        # Fetch the unlocked set and the player's counters concurrently
+        unlocked_ids, counters = await asyncio.gather(
+            get_unlocked_ids(player_name),
+            repository.get_player_stats(player_name)
+        )
+        counters = counters or {}
+    else:
+        unlocked_ids = await get_unlocked_ids(player_name)
+    
+    new_achievements = get_unlockable_achievements(
+        unlocked_ids, height, completed, completion_time,
+        counters.get("games_played", 0), counters.get("completions", 0)
+    )
+    return await unlock_player_achievements(player_name, new_achievements)
+
+async def check_batch_achievements(player_name: str, scores: List[GameScore], previous: dict):
+    """Evaluate a player's batch of scores in order against counters fetched once"""
     try:
-        # Get existing unlocked achievements
-        unlocked = await db.player_achievements.find({"player_name": player_name}).to_list(100)
-        unlocked_ids = {a["achievement_id"] for a in unlocked}
+        unlocked_ids = await get_unlocked_ids(player_name)
+        games_played = previous.get("games_played", 0)
+        completions = previous.get("completions", 0)
         
+        earned = {}
         new_achievements = []
-        
-        # Check height-based achievements
-        height_achievements = get_achievements_for_height(height)
-        for achievement in height_achievements:
-            if achievement["id"] not in unlocked_ids:
-                new_achievements.append(achievement)
-        
-        # Check completion achievements
-        if completed:
-            completion_achievements = get_completion_achievements()
-            for achievement in completion_achievements:
-                if achievement["id"] not in unlocked_ids:
-                    # Check specific completion criteria
-                    criteria = achievement["unlock_criteria"]
-                    should_unlock = False
-                    
-                    if criteria["type"] == "completion":
-                        should_unlock = True
-                    elif criteria["type"] == "completion_time" and completion_time:
-                        should_unlock = completion_time <= criteria["value"]
-                    elif criteria["type"] == "completions":
-                        # Count completions for this player
-                        completions = await db.game_scores.count_documents({
-                            "player_name": player_name,
-                            "completed": True
-                        })
-                        should_unlock = completions >= criteria["value"]
-                    
-                    if should_unlock:
-                        new_achievements.append(achievement)
-        
-        # Check games played achievements
-        total_games = await db.game_scores.count_documents({"player_name": player_name})
-        for achievement in ACHIEVEMENTS:
-            if (achievement["unlock_criteria"]["type"] == "games_played" and 
-                achievement["id"] not in unlocked_ids and
-                total_games >= achievement["unlock_criteria"]["value"]):
-                new_achievements.append(achievement)
-        
-        # Unlock new achievements
-        for achievement in new_achievements:
-            player_achievement = PlayerAchievement(
-                player_name=player_name,
-                achievement_id=achievement["id"]
+        for score in scores:
+            games_played += 1
+            completions += 1 if score.completed else 0
+            achievements = get_unlockable_achievements(
+                unlocked_ids, score.height, score.completed, score.completion_time, games_played, completions
             )
-            await db.player_achievements.insert_one(player_achievement.dict())
+            unlocked_ids.update(a["id"] for a in achievements)
+            earned[score.id] = achievements
+            new_achievements.extend(achievements)
         
-        return new_achievements
+        # Report only what this batch actually unlocked
+        unlocked = await unlock_player_achievements(player_name, new_achievements)
+        unlocked_now = {a["id"] for a in unlocked}
+        return {
+            score_id: [a["id"] for a in achievements if a["id"] in unlocked_now]
+            for score_id, achievements in earned.items()
+        }
         
-    except Exception as e:
-        print(f"Error checking achievements: {e}")
-        return []
\ No newline at end of file
+    except Exception:
+        logger.exception("Checking batch achievements failed for %s", player_name)
+        return {}
+
+async def get_unlocks(player_name: str) -> dict:
+    """Map of achievement id to unlock time for a player, through the unlock cache"""
+    return await unlock_cache.get(player_name, repository.get_unlocks)
+
+async def get_unlocked_ids(player_name: str) -> set:
+    """Return the ids of the achievements a player has unlocked"""
+    return set(await get_unlocks(player_name))
+
+async def unlock_player_achievements(player_name: str, achievements: List[dict]) -> List[dict]:
+    """Store achievement unlocks and return the ones that were not already unlocked
+    
+    The new unlocks are also recorded for /achievements/{player_name}/recent,
+    with the unlock times storage kept.
+    """
+    created = await repository.add_unlocks(player_name, [a["id"] for a in achievements])
+    if not created:
+        return []
+    cache_changed("unlocks", player_name=player_name)
+    unlocked = [achievement for achievement in achievements if achievement["id"] in created]
+    achievement_worker.record(player_name, [(achievement, created[achievement["id"]]) for achievement in unlocked])
+    return unlocked
+
+# Helper functions for the materialized stats
+async def record_player_scores(player_name: str, scores: List[GameScore]):
+    """Fold one player's scores into their stats document in a single write
+    
+    Returns the previous stats document and, per score, whether it set a new record.
+    """
+    completions = sum(1 for score in scores if score.completed)
+    completion_times = [
+        score.completion_time for score in scores
+        if score.completed and score.completion_time is not None
+    ]
+    fold = (
+        player_name,
+        scores[0].id,
+        max(score.height for score in scores),
+        len(scores),
+        completions,
+        min(completion_times) if completion_times else None
+    )
+    # The all-time stats and the day, week and month buckets are written together
+    previous, _ = await asyncio.gather(
+        repository.fold_player_stats(*fold),
+        repository.fold_period_stats(period_buckets(scores[0].created_at), *fold)
+    )
+    previous = previous or {}
+    
+    # The batch only holds part of the player's period stats, so it cannot tell which boards they enter
+    cache_changed("windows")
+    
+    best_height = previous.get("height", -1)
+    new_records = []
+    for score in scores:
+        new_records.append(score.height > best_height)
+        best_height = max(best_height, score.height)
+    
+    # Only drop cached leaderboards if the visible stats of this player changed
+    if any(new_records) or completions:
+        best_times = [t for t in completion_times + [previous.get("best_time")] if t is not None]
+        cache_changed(
+            "board",
+            player_name=player_name,
+            height=best_height,
+            completions=previous.get("completions", 0) + completions,
+            score_id=previous.get("id", scores[0].id),
+            best_time=min(best_times) if best_times else None
+        )
+    
+    return previous, new_records
+
+async def increment_game_stats(scores: List[GameScore]):
+    """Fold scores into the global counters behind /api/stats"""
+    await repository.increment_game_stats(
+        total_plays=len(scores),
+        height_sum=sum(score.height for score in scores),
+        completions=sum(1 for score in scores if score.completed)
+    )
+    cache_changed("stats")
+
+# Changes to the in-process caches above. Each is applied in this worker by cache_changed()
+# and, with coherence enabled, replayed in every other worker by cache_coherence
+def board_changed(player_name: str, height: int, completions: int, score_id: str, best_time: Optional[int]):
+    """A player's all-time stats changed: move them in the rank index and drop leaderboards they affect"""
+    current = rank_index.key_of(player_name)
+    if current is not None and current < rank_key(player_name, height, completions):
+        # Stats only grow, so this is an older change arriving after a newer one
+        return
+    leaderboard_cache.invalidate_for(player_name, height, completions)
+    leaderboard_stream.notify(player_name, height, completions)
+    versions.bump("leaderboard")
+    rank_index.update(player_name, height, completions, id=score_id, best_time=best_time)
+
+def windows_changed():
+    for cache in window_caches.values():
+        cache.invalidate_all()
+    versions.bump("leaderboard_window")
+
+def game_stats_changed():
+    versions.bump("stats")
+
+def unlocks_changed(player_name: str):
+    unlock_cache.invalidate(player_name)
+    versions.bump_player(player_name)
+
+CACHE_CHANGE_HANDLERS = {
+    "board": board_changed,
+    "windows": windows_changed,
+    "stats": game_stats_changed,
+    "unlocks": unlocks_changed,
+}
+
+def cache_changed(kind: str, **fields):
+    """Apply a cache change in this worker and publish it to the others"""
+    CACHE_CHANGE_HANDLERS[kind](**fields)
+    cache_coherence.publish(kind, **fields)
+
+async def resync_caches():
+    """Rebuild every cache after missing changes published by other workers"""
+    leaderboard_cache.invalidate_all()
+    for cache in window_caches.values():
+        cache.invalidate_all()
+    unlock_cache.invalidate_all()
+    versions.reset()
+    await load_rank_index()
+
+def cache_version_store():
+    path = os.environ.get("CACHE_COHERENCE_FILE")
+    if path:
+        return SqliteVersionStore(path)
+    if env_flag("CACHE_COHERENCE"):
+        return repository.cache_version_store()
+    return None
+
+# Opt-in for several worker processes: CACHE_COHERENCE shares cache changes through the
+# storage engine (MongoDB), CACHE_COHERENCE_FILE through a SQLite file for local workers
+cache_coherence = CacheCoherence(
+    cache_version_store(),
+    CACHE_CHANGE_HANDLERS,
+    resync_caches,
+    interval=float(os.environ.get("CACHE_COHERENCE_INTERVAL", "0.5"))
+)
+if not cache_coherence.enabled:
+    # Other workers' writes never bump this worker's counters, so let validators expire with the caches
+    versions.max_age = CACHE_TTL
+
+# Background achievement evaluation, opt-in through ACHIEVEMENT_WORKERS
+achievement_worker = AchievementWorker(
+    check_and_unlock_achievements,
+    workers=int(os.environ.get("ACHIEVEMENT_WORKERS", "0")),
+    max_queue=int(os.environ.get("ACHIEVEMENT_QUEUE_SIZE", "1000"))
+)
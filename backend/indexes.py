@@ -0,0 +1,96 @@
+"""
+Index declarations for the hot queries in game_routes.py, plus a query plan check.
+
+Every query the request path runs should be listed in HOT_QUERIES and be served
+by one of the INDEXES; verify_query_plans() explains each one and fails on a
+collection scan.
+"""
+import logging
+from typing import List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+logger = logging.getLogger(__name__)
+
+INDEXES = {
+    "player_stats": [
+        IndexModel([("player_name", ASCENDING)], name="player_name_unique", unique=True),
+        IndexModel(
+            [("height", DESCENDING), ("completions", DESCENDING), ("player_name", ASCENDING)],
+            name="leaderboard_order"
+        ),
+    ],
+    "leaderboard_periods": [
+        IndexModel([("period", ASCENDING), ("player_name", ASCENDING)], name="period_player_unique", unique=True),
+        IndexModel(
+            [("period", ASCENDING), ("height", DESCENDING), ("completions", DESCENDING), ("player_name", ASCENDING)],
+            name="period_leaderboard_order"
+        ),
+        # Buckets are removed once their expires_at has passed
+        IndexModel([("expires_at", ASCENDING)], name="period_expiry", expireAfterSeconds=0),
+    ],
+    "game_sessions": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+}
+
+# Indexes no query uses any more, dropped so writes stop maintaining them
+OBSOLETE_INDEXES = {
+    # Score reads moved to player_stats; game_scores is only inserted into and rebuilt from
+    "game_scores": ["player_completed", "player_height"],
+    # Replaced by the *_order indexes, which also break ties by player name
+    "player_stats": ["leaderboard"],
+    "leaderboard_periods": ["period_leaderboard"],
+}
+
+# (name, collection, filter, sort) of every query the request path runs
+HOT_QUERIES = [
+    ("leaderboard", "player_stats", {}, [("height", -1), ("completions", -1), ("player_name", 1)]),
+    ("player stats", "player_stats", {"player_name": "probe"}, None),
+    ("window leaderboard", "leaderboard_periods", {"period": "probe"}, [("height", -1), ("completions", -1), ("player_name", 1)]),
+    ("player unlocks", "player_unlocks", {"_id": "probe"}, None),
+    ("session", "game_sessions", {"id": "probe"}, None),
+]
+
+
+async def ensure_indexes(db):
+    """Create every declared index and drop obsolete ones; existing indexes are left as they are"""
+    for collection, indexes in INDEXES.items():
+        names = await db[collection].create_indexes(indexes)
+        logger.info("Indexes ready on %s: %s", collection, ", ".join(names))
+    for collection, names in OBSOLETE_INDEXES.items():
+        existing = await db[collection].index_information()
+        for name in names:
+            if name in existing:
+                await db[collection].drop_index(name)
+                logger.info("Dropped unused index %s on %s", name, collection)
+
+
+def find_collscans(plan) -> List[str]:
+    """Return the stages of an explain plan that scan a whole collection"""
+    found = []
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            found.append(plan.get("namespace") or "COLLSCAN")
+        for value in plan.values():
+            found.extend(find_collscans(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            found.extend(find_collscans(value))
+    return found
+
+
+async def verify_query_plans(db):
+    """Explain every hot query and raise if any of them falls back to a collection scan"""
+    failures = []
+    for name, collection, query, sort in HOT_QUERIES:
+        cursor = db[collection].find(query).limit(10)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        if find_collscans(explain.get("queryPlanner", {}).get("winningPlan", {})):
+            failures.append(f"{name} ({collection} {query})")
+
+    if failures:
+        raise RuntimeError("Queries without a usable index: " + "; ".join(failures))
+    logger.info("Query plans verified for %d hot queries", len(HOT_QUERIES))
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from fast_json import dumps
+from models import LeaderboardEntry
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    """One stream client: a bounded queue of pending events"""
+
+    def __init__(self, max_pending: int):
+        self.events: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        # Set when the client fell behind and must be sent a fresh snapshot
+        self.resync = False
+
+
+class LeaderboardBroadcaster:
+    """Shares one top-N leaderboard computation between every stream subscriber
+
+    Writers call notify() with a player's new stats; if they could change the
+    board, a single recompute runs after a short debounce and the difference
+    from the previous board is queued to every subscriber. Subscribers that
+    fall behind are resynced with a snapshot instead of growing their queue.
+    """
+
+    def __init__(self, loader: Callable[[int], Awaitable[List[LeaderboardEntry]]], size: int = 10,
+                 debounce: float = 0.1, max_pending: int = 100):
+        self.loader = loader
+        self.size = size
+        self.debounce = debounce
+        self.max_pending = max_pending
+        self.subscribers: Set[Subscriber] = set()
+        self.version = 0
+        self._board: Optional[List[LeaderboardEntry]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        self.recomputes = 0
+        self.diffs = 0
+
+    async def snapshot(self) -> dict:
+        """Current board, loaded if no recompute has run yet"""
+        if self._board is None:
+            self._board = await self.loader(self.size)
+        return {"version": self.version, "entries": [entry.model_dump() for entry in self._board]}
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(self.max_pending)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+        if not self.subscribers:
+            # Nobody listening: the next subscriber loads a fresh board
+            self._board = None
+
+    def notify(self, player_name: str, height: int, completions: int):
+        """Schedule a recompute if a player's new stats could change the board"""
+        if not self.subscribers or self._closed or self._task is not None:
+            return
+        if self._board is not None and not self._affects(player_name, height, completions):
+            return
+        self._task = asyncio.ensure_future(self._recompute())
+
+    def _affects(self, player_name: str, height: int, completions: int) -> bool:
+        board = self._board
+        if len(board) < self.size or any(entry.name == player_name for entry in board):
+            return True
+        last = board[-1]
+        return (height, completions) >= (last.height, last.completions)
+
+    async def _recompute(self):
+        try:
+            # Let a burst of submissions settle into one recompute
+            await asyncio.sleep(self.debounce)
+            self._task = None
+            self.recomputes += 1
+            previous, self._board = self._board, await self.loader(self.size)
+            diff = self.diff(previous or [], self._board)
+            if diff:
+                self.version += 1
+                self.diffs += 1
+                self._publish({"version": self.version, **diff})
+        except Exception:
+            self._task = None
+            logger.exception("Leaderboard stream recompute failed")
+
+    @staticmethod
+    def diff(before: List[LeaderboardEntry], after: List[LeaderboardEntry]) -> dict:
+        """Entries that entered, left, moved rank or changed stats between two boards"""
+        old = {entry.name: (rank, entry) for rank, entry in enumerate(before, 1)}
+        new = {entry.name: (rank, entry) for rank, entry in enumerate(after, 1)}
+        entered, moved, updated = [], [], []
+        for name, (rank, entry) in new.items():
+            if name not in old:
+                entered.append({"rank": rank, **entry.model_dump()})
+                continue
+            old_rank, old_entry = old[name]
+            if old_rank != rank:
+                moved.append({"rank": rank, "previous_rank": old_rank, **entry.model_dump()})
+            elif old_entry != entry:
+                updated.append({"rank": rank, **entry.model_dump()})
+        left = [name for name in old if name not in new]
+        if not (entered or left or moved or updated):
+            return {}
+        return {"entered": entered, "left": left, "moved": moved, "updated": updated}
+
+    def _publish(self, diff: dict):
+        for subscriber in self.subscribers:
+            if subscriber.resync:
+                continue
+            try:
+                subscriber.events.put_nowait(diff)
+            except asyncio.QueueFull:
+                subscriber.resync = True
+                subscriber.events = asyncio.Queue(maxsize=self.max_pending)
+
+    def close(self):
+        """Stop recomputing and wake every subscriber so their streams end"""
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for subscriber in self.subscribers:
+            try:
+                subscriber.events.put_nowait(None)
+            except asyncio.QueueFull:
+                subscriber.resync = True
+                subscriber.events = asyncio.Queue(maxsize=1)
+                subscriber.events.put_nowait(None)
+
+    async def stream(self, heartbeat: float = 15.0):
+        """Server-Sent Events for a new subscriber: a snapshot, then diffs
+
+        The subscriber only exists while the generator runs, so a response
+        cancelled before it starts iterating leaves nothing subscribed.
+        """
+        subscriber = self.subscribe()
+        try:
+            yield self.event("snapshot", await self.snapshot())
+            while True:
+                if subscriber.resync:
+                    subscriber.resync = False
+                    yield self.event("snapshot", await self.snapshot())
+                try:
+                    diff = await asyncio.wait_for(subscriber.events.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    # Comment line keeping proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                if diff is None:
+                    return
+                yield self.event("diff", diff)
+        finally:
+            self.unsubscribe(subscriber)
+
+    @staticmethod
+    def event(name: str, data: dict) -> str:
+        return f"event: {name}\nid: {data['version']}\ndata: {dumps(data).decode()}\n\n"
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "subscribers": len(self.subscribers),
+            "version": self.version,
+            "recomputes": self.recomputes,
+            "diffs": self.diffs,
+        }
@@ -0,0 +1,63 @@
+"""
+Maintenance commands for the Plastic Bag King backend.
+
+Usage (from the backend directory):
+    python maintenance.py rebuild-player-stats
+    python maintenance.py rebuild-game-stats
+    python maintenance.py check-query-plans
+    python maintenance.py migrate-unlocks
+"""
+import argparse
+import asyncio
+
+from server import repository
+
+
+async def rebuild_player_stats():
+    """Recompute the per-player stats behind the leaderboard from the raw scores"""
+    return await repository.rebuild_player_stats()
+
+
+async def rebuild_game_stats():
+    """Recompute the global counters behind /api/stats from the scores and sessions"""
+    return await repository.rebuild_game_stats()
+
+
+async def check_query_plans():
+    """Create the declared indexes and fail if any hot query still scans a collection"""
+    await repository.ensure_indexes(verify=True)
+    return "ok"
+
+
+async def migrate_unlocks():
+    """Fold the per-unlock player_achievements rows into the per-player unlock masks; safe to rerun"""
+    return await repository.migrate_unlocks()
+
+
+COMMANDS = {
+    "rebuild-player-stats": rebuild_player_stats,
+    "rebuild-game-stats": rebuild_game_stats,
+    "check-query-plans": check_query_plans,
+    "migrate-unlocks": migrate_unlocks,
+}
+
+
+async def run(command):
+    try:
+        await repository.connect()
+        return await COMMANDS[command]()
+    finally:
+        await repository.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plastic Bag King maintenance commands")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.command))
+    print(f"{args.command}: {result}")
+
+
+if __name__ == "__main__":
+    main()
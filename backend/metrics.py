@@ -0,0 +1,182 @@
+"""
+Per-route request metrics in Prometheus text format.
+
+MetricsMiddleware records, per method and route template (e.g.
+/api/session/{session_id} rather than the raw path), the request count,
+error count (5xx or unhandled exception), a latency histogram and a gauge
+of requests in flight. Each route's counters live in preallocated slots, so
+recording a request is a few integer increments. The route is matched when
+the request arrives, the way the router will match it, so a request is
+counted in flight under its route for as long as it runs.
+"""
+import asyncio
+import time
+from bisect import bisect_left
+from typing import Dict, Tuple
+
+from starlette.routing import Match
+
+# Latency histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class RouteMetrics:
+    __slots__ = ("in_flight", "requests", "errors", "duration_sum", "buckets")
+
+    def __init__(self):
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.duration_sum = 0.0
+        # One slot per bucket plus the +Inf overflow, not cumulative
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds: float, error: bool):
+        self.requests += 1
+        self.duration_sum += seconds
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        if error:
+            self.errors += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.routes: Dict[Tuple[str, str], RouteMetrics] = {}
+        # Total across routes, for waiting until every request has finished
+        self.in_flight = 0
+        self._templates = {}
+
+    def route_template(self, scope) -> str:
+        """Route template for the endpoint the router matched, set on the scope during routing"""
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        template = self._templates.get(endpoint)
+        if template is None:
+            template = self._templates[endpoint] = self._find_template(scope, endpoint)
+        return template
+
+    @staticmethod
+    def _find_template(scope, endpoint) -> str:
+        app = scope.get("app")
+        for route in getattr(app, "routes", ()):
+            if getattr(route, "endpoint", None) is endpoint:
+                return route.path
+        return UNMATCHED_ROUTE
+
+    @staticmethod
+    def match_template(scope) -> str:
+        """Route template the router will match for a request that has not been routed yet"""
+        partial = None
+        for route in getattr(scope.get("app"), "routes", ()):
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", UNMATCHED_ROUTE)
+            if match == Match.PARTIAL and partial is None:
+                # Right path, other method: the router answers 405 from this route
+                partial = getattr(route, "path", UNMATCHED_ROUTE)
+        return partial or UNMATCHED_ROUTE
+
+    def slot(self, method: str, route: str) -> RouteMetrics:
+        key = (method, route)
+        metrics = self.routes.get(key)
+        if metrics is None:
+            metrics = self.routes[key] = RouteMetrics()
+        return metrics
+
+    def observe(self, method: str, route: str, seconds: float, error: bool):
+        self.slot(method, route).observe(seconds, error)
+
+    async def wait_idle(self, timeout: float, poll_interval: float = 0.05) -> bool:
+        """Wait until no request is in flight; False if some still are after timeout"""
+        deadline = time.monotonic() + timeout
+        while self.in_flight > 0:
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(poll_interval)
+        return True
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        routes = sorted(self.routes.items())
+        lines = [
+            "# HELP http_requests_in_flight Requests currently being served per route",
+            "# TYPE http_requests_in_flight gauge",
+        ]
+        for (method, route), metrics in routes:
+            lines.append(f"http_requests_in_flight{prometheus_labels(method, route)} {metrics.in_flight}")
+
+        lines += [
+            "# HELP http_requests_total Requests served per route",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route), metrics in routes:
+            lines.append(f"http_requests_total{prometheus_labels(method, route)} {metrics.requests}")
+
+        lines += [
+            "# HELP http_request_errors_total Requests that failed with a 5xx or an unhandled exception",
+            "# TYPE http_request_errors_total counter",
+        ]
+        for (method, route), metrics in routes:
+            lines.append(f"http_request_errors_total{prometheus_labels(method, route)} {metrics.errors}")
+
+        lines += [
+            "# HELP http_request_duration_seconds Request latency per route",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), metrics in routes:
+            cumulative = 0
+            for bound, count in zip(BUCKETS, metrics.buckets):
+                cumulative += count
+                lines.append(f"http_request_duration_seconds_bucket{prometheus_labels(method, route, le=repr(bound))} {cumulative}")
+            lines.append(f"http_request_duration_seconds_bucket{prometheus_labels(method, route, le='+Inf')} {metrics.requests}")
+            lines.append(f"http_request_duration_seconds_sum{prometheus_labels(method, route)} {metrics.duration_sum}")
+            lines.append(f"http_request_duration_seconds_count{prometheus_labels(method, route)} {metrics.requests}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def prometheus_labels(method: str, route: str, **extra) -> str:
+    """Label set for a method and route, plus any extra labels"""
+    labels = [f'method="{method}"', f'route="{_escape(route)}"']
+    labels += [f'{name}="{value}"' for name, value in extra.items()]
+    return "{" + ",".join(labels) + "}"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording every HTTP request into a MetricsRegistry"""
+
+    def __init__(self, app, registry: MetricsRegistry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        registry = self.registry
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        metrics = registry.slot(scope["method"], registry.match_template(scope))
+        registry.in_flight += 1
+        metrics.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            registry.in_flight -= 1
+            metrics.in_flight -= 1
+            metrics.observe(time.perf_counter() - started, status >= 500)
@@ -61,6 +61,19 @@ class ScoreResponse(BaseModel):
     score_id: str
     new_record: bool = False
 
+class BatchScoreResult(BaseModel):
+    index: int
+    success: bool
+    score_id: Optional[str] = None
+    new_record: bool = False
+    achievements: List[str] = []
+    error: Optional[str] = None
+
+class BatchScoreResponse(BaseModel):
+    saved: int
+    failed: int
+    results: List[BatchScoreResult]
+
 class LeaderboardEntry(BaseModel):
     id: str
     name: str
@@ -68,6 +81,20 @@ class LeaderboardEntry(BaseModel):
     completions: int
     best_time: Optional[int] = None
 
+class RankedLeaderboardEntry(LeaderboardEntry):
+    rank: int
+
+class LeaderboardPage(BaseModel):
+    entries: List[RankedLeaderboardEntry]
+    next_cursor: Optional[str] = None
+    total_players: int
+
+class PlayerRank(BaseModel):
+    player_name: str
+    rank: int
+    total_players: int
+    entries: List[RankedLeaderboardEntry]
+
 class GameStats(BaseModel):
     total_plays: int
     average_height: float
@@ -80,4 +107,19 @@ class AchievementWithStatus(BaseModel):
     description: str
     icon: str
     unlocked: bool = False
-    unlocked_at: Optional[datetime] = None
\ No newline at end of file
+    unlocked_at: Optional[datetime] = None
+
+class PlayerProfile(BaseModel):
+    player_name: str
+    best_height: int = 0
+    completions: int = 0
+    best_time: Optional[int] = None
+    games_played: int = 0
+    rank: Optional[int] = None
+    total_players: int = 0
+    achievements: List[AchievementWithStatus]
+
+class RecentUnlocks(BaseModel):
+    player_name: str
+    pending: int = 0
+    unlocks: List[AchievementWithStatus] = []
@@ -0,0 +1,435 @@
+"""
+MongoDB storage engine, imported only when STORAGE_BACKEND=mongo.
+
+Client pool and timeout settings and the write concern of each group of
+writes come from the environment:
+
+    MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_TIME_MS,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_SOCKET_TIMEOUT_MS
+    MONGO_WRITE_CONCERN                 default w for every write ("majority" or a number)
+    MONGO_WRITE_CONCERN_SCORES          score submissions and the stats folded from them
+    MONGO_WRITE_CONCERN_STATS           global counters behind /api/stats
+    MONGO_WRITE_CONCERN_SESSIONS        session start and progress
+    MONGO_WRITE_CONCERN_ACHIEVEMENTS    achievement unlocks
+"""
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.write_concern import WriteConcern
+
+from achievements import ACHIEVEMENT_BITS, decode_unlocks, unlock_mask
+from indexes import ensure_indexes, verify_query_plans
+from storage import GAME_STATS_FIELDS, GLOBAL_STATS_ID, LEADERBOARD_SORT, GameRepository
+
+# Client options read from the environment, with the type each one is parsed as
+CLIENT_OPTIONS = {
+    "maxPoolSize": ("MONGO_MAX_POOL_SIZE", int),
+    "minPoolSize": ("MONGO_MIN_POOL_SIZE", int),
+    "maxIdleTimeMS": ("MONGO_MAX_IDLE_TIME_MS", int),
+    "serverSelectionTimeoutMS": ("MONGO_SERVER_SELECTION_TIMEOUT_MS", int),
+    "connectTimeoutMS": ("MONGO_CONNECT_TIMEOUT_MS", int),
+    "socketTimeoutMS": ("MONGO_SOCKET_TIMEOUT_MS", int),
+}
+
+WRITE_GROUPS = ("scores", "stats", "sessions", "achievements")
+
+
+class _CommandListener(monitoring.CommandListener):
+    """Registers a plain listener object (such as db_metrics.CommandStatsListener) with PyMongo"""
+
+    def __init__(self, listener):
+        self.listener = listener
+
+    def started(self, event):
+        self.listener.started(event)
+
+    def succeeded(self, event):
+        self.listener.succeeded(event)
+
+    def failed(self, event):
+        self.listener.failed(event)
+
+
+def client_options_from_env() -> dict:
+    options = {}
+    for option, (variable, parse) in CLIENT_OPTIONS.items():
+        value = os.environ.get(variable)
+        if value:
+            options[option] = parse(value)
+    return options
+
+
+def parse_write_concern(value: str) -> WriteConcern:
+    """WriteConcern for "majority" or a number of acknowledging members (at least 1)"""
+    if value == "majority":
+        return WriteConcern(w="majority")
+    w = int(value)
+    if w < 1:
+        # Unlocks and stats folds read back the document they update
+        raise ValueError(f"Write concern must be acknowledged, got w={w}")
+    return WriteConcern(w=w)
+
+
+def write_concerns_from_env() -> Dict[str, WriteConcern]:
+    default = os.environ.get("MONGO_WRITE_CONCERN")
+    write_concerns = {}
+    for group in WRITE_GROUPS:
+        value = os.environ.get(f"MONGO_WRITE_CONCERN_{group.upper()}", default)
+        if value:
+            write_concerns[group] = parse_write_concern(value)
+    return write_concerns
+
+
+def unlock_update(achievement_ids: List[str], unlocked_at: datetime) -> dict:
+    """Update setting achievements' bits on a player_unlocks document, keeping the first unlock times"""
+    return {
+        "$bit": {"mask": {"or": unlock_mask(achievement_ids)}},
+        "$min": {f"ts.{ACHIEVEMENT_BITS[achievement_id]}": unlocked_at for achievement_id in achievement_ids},
+    }
+
+
+class MotorRepository(GameRepository):
+    """MongoDB storage through Motor
+
+    The client is created on first use, so building the repository needs no
+    MONGO_URL and opens no connections; connect() creates it and pings the
+    server. Writes go through databases carrying the write concern configured
+    for their group (scores, stats, sessions, achievements).
+    """
+
+    def __init__(self, url: Optional[str], db_name: Optional[str], client_options: Optional[dict] = None,
+                 write_concerns: Optional[Dict[str, WriteConcern]] = None):
+        self.url = url
+        self.db_name = db_name
+        self.client_options = client_options or {}
+        self.write_concerns = write_concerns or {}
+        self._client = None
+        self._write_dbs = {}
+
+    @classmethod
+    def from_env(cls, **client_options):
+        return cls(
+            os.environ.get("MONGO_URL"),
+            os.environ.get("DB_NAME"),
+            {**client_options_from_env(), **client_options},
+            write_concerns_from_env()
+        )
+
+    @property
+    def client(self):
+        if self._client is None:
+            if not self.url or not self.db_name:
+                raise RuntimeError("MONGO_URL and DB_NAME must be set for STORAGE_BACKEND=mongo")
+            options = dict(self.client_options)
+            if "event_listeners" in options:
+                options["event_listeners"] = [
+                    listener if isinstance(listener, monitoring.CommandListener) else _CommandListener(listener)
+                    for listener in options["event_listeners"]
+                ]
+            self._client = AsyncIOMotorClient(self.url, **options)
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.db_name]
+
+    def _writes(self, group: str):
+        """Database handle whose collections use the write concern of a write group"""
+        database = self._write_dbs.get(group)
+        if database is None:
+            write_concern = self.write_concerns.get(group)
+            database = self.client.get_database(self.db_name, write_concern=write_concern)
+            self._write_dbs[group] = database
+        return database
+
+    async def connect(self):
+        # Selecting a server for the ping also fills the pool's first connection
+        await self.client.admin.command("ping")
+
+    async def insert_score(self, score: dict):
+        await self._writes("scores").game_scores.insert_one(score)
+
+    async def insert_scores(self, scores: List[dict]) -> Dict[int, str]:
+        try:
+            await self._writes("scores").game_scores.insert_many(scores, ordered=False)
+        except BulkWriteError as e:
+            return {
+                error["index"]: error.get("errmsg", "Insert failed")
+                for error in e.details.get("writeErrors", [])
+            }
+        return {}
+
+    async def fold_player_stats(self, player_name, score_id, height, games_played, completions, best_time):
+        update = {
+            "$max": {"height": height},
+            "$inc": {"games_played": games_played, "completions": completions},
+            "$setOnInsert": {"id": score_id},
+        }
+        if best_time is not None:
+            update["$min"] = {"best_time": best_time}
+
+        try:
+            return await self._writes("scores").player_stats.find_one_and_update(
+                {"player_name": player_name},
+                update,
+                projection={"_id": 0},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            # A concurrent first score for this player created the document; retry as a plain update
+            return await self._writes("scores").player_stats.find_one_and_update(
+                {"player_name": player_name},
+                update,
+                projection={"_id": 0},
+                return_document=ReturnDocument.BEFORE
+            )
+
+    async def get_player_stats(self, player_name):
+        return await self.db.player_stats.find_one({"player_name": player_name}, {"_id": 0})
+
+    async def top_players(self, limit):
+        return await self.db.player_stats.find(
+            {}, {"_id": 0}
+        ).sort(LEADERBOARD_SORT).limit(limit).to_list(limit)
+
+    async def scan_player_stats(self):
+        projection = {"_id": 0, "player_name": 1, "id": 1, "height": 1, "completions": 1, "best_time": 1}
+        async for stats in self.db.player_stats.find({}, projection).batch_size(1000):
+            yield stats
+
+    async def fold_period_stats(self, periods, player_name, score_id, height, games_played, completions, best_time):
+        """One unordered bulk_write of upserts keyed on (period, player_name)"""
+        def fold(period, expires_at, upsert):
+            update = {
+                "$max": {"height": height, "expires_at": expires_at},
+                "$inc": {"games_played": games_played, "completions": completions},
+                "$setOnInsert": {"id": score_id},
+            }
+            if best_time is not None:
+                update["$min"] = {"best_time": best_time}
+            return UpdateOne({"period": period, "player_name": player_name}, update, upsert=upsert)
+
+        try:
+            await self._writes("scores").leaderboard_periods.bulk_write(
+                [fold(period, expires_at, True) for period, expires_at in periods], ordered=False
+            )
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in errors):
+                raise
+            # A concurrent first score in the period created the bucket; retry those as plain updates
+            await self._writes("scores").leaderboard_periods.bulk_write(
+                [fold(*periods[error["index"]], False) for error in errors], ordered=False
+            )
+
+    async def top_period_players(self, period, limit):
+        return await self.db.leaderboard_periods.find(
+            {"period": period}, {"_id": 0}
+        ).sort(LEADERBOARD_SORT).limit(limit).to_list(limit)
+
+    async def get_game_stats(self):
+        return await self.db.game_stats.find_one({"_id": GLOBAL_STATS_ID}, {"_id": 0}) or {}
+
+    async def increment_game_stats(self, **deltas):
+        await self._writes("stats").game_stats.update_one(
+            {"_id": GLOBAL_STATS_ID},
+            {"$inc": deltas},
+            upsert=True
+        )
+
+    async def insert_session(self, session):
+        await self._writes("sessions").game_sessions.insert_one(session)
+
+    async def get_session(self, session_id):
+        return await self.db.game_sessions.find_one({"id": session_id}, {"_id": 0})
+
+    async def update_session(self, session_id, fields):
+        return await self._writes("sessions").game_sessions.find_one_and_update(
+            {"id": session_id},
+            {"$set": fields},
+            projection={"_id": 0},
+            return_document=ReturnDocument.BEFORE
+        )
+
+    async def update_sessions(self, updates):
+        await self._writes("sessions").game_sessions.bulk_write(
+            [UpdateOne({"id": session_id}, {"$set": fields}) for session_id, fields in updates.items()],
+            ordered=False
+        )
+
+    async def get_unlocks(self, player_name):
+        unlocks = await self.db.player_unlocks.find_one({"_id": player_name})
+        if unlocks is None:
+            return {}
+        return decode_unlocks(unlocks.get("mask", 0), unlocks.get("ts", {}))
+
+    async def add_unlocks(self, player_name, achievement_ids):
+        """One atomic $bit or on the player's unlock mask, returning the mask from before it
+
+        Repeating an unlock is harmless: $min keeps the first unlock time, and
+        only the request whose update flipped a bit reports that achievement as
+        new, with the time it stored.
+        """
+        if not achievement_ids:
+            return {}
+
+        now = datetime.utcnow()
+        update = unlock_update(achievement_ids, now)
+        try:
+            before = await self._writes("achievements").player_unlocks.find_one_and_update(
+                {"_id": player_name}, update, projection={"mask": 1}, upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            # A concurrent first unlock for this player created the document; retry as a plain update
+            before = await self._writes("achievements").player_unlocks.find_one_and_update(
+                {"_id": player_name}, update, projection={"mask": 1},
+                return_document=ReturnDocument.BEFORE
+            )
+
+        previous_mask = before.get("mask", 0) if before else 0
+        # Mongo stores datetimes to the millisecond
+        stored_at = now.replace(microsecond=now.microsecond // 1000 * 1000)
+        return {
+            achievement_id: stored_at for achievement_id in achievement_ids
+            if not previous_mask >> ACHIEVEMENT_BITS[achievement_id] & 1
+        }
+
+    async def ensure_indexes(self, verify=False):
+        await ensure_indexes(self.db)
+        if verify:
+            await verify_query_plans(self.db)
+
+    async def migrate_unlocks(self):
+        """Fold the one-document-per-unlock player_achievements rows into player_unlocks masks"""
+        players = await self.db.player_achievements.aggregate([
+            {
+                "$group": {
+                    "_id": "$player_name",
+                    "unlocks": {"$push": {"achievement_id": "$achievement_id", "unlocked_at": "$unlocked_at"}}
+                }
+            }
+        ]).to_list(None)
+
+        operations, migrated, skipped = [], 0, 0
+        for player in players:
+            known = [unlock for unlock in player["unlocks"] if unlock["achievement_id"] in ACHIEVEMENT_BITS]
+            skipped += len(player["unlocks"]) - len(known)
+            if not known:
+                continue
+            update = {
+                "$bit": {"mask": {"or": unlock_mask(unlock["achievement_id"] for unlock in known)}},
+                "$min": {f"ts.{ACHIEVEMENT_BITS[u['achievement_id']]}": u["unlocked_at"] for u in known},
+            }
+            operations.append(UpdateOne({"_id": player["_id"]}, update, upsert=True))
+            migrated += len(known)
+
+        for start in range(0, len(operations), 1000):
+            await self.db.player_unlocks.bulk_write(operations[start:start + 1000], ordered=False)
+        return {"players": len(operations), "unlocks": migrated, "skipped": skipped}
+
+    async def rebuild_player_stats(self):
+        pipeline = [
+            {"$sort": {"created_at": 1}},
+            {
+                "$group": {
+                    "_id": "$player_name",
+                    "id": {"$first": "$id"},
+                    "height": {"$max": "$height"},
+                    "games_played": {"$sum": 1},
+                    "completions": {"$sum": {"$cond": ["$completed", 1, 0]}},
+                    "best_time": {"$min": {"$cond": ["$completed", "$completion_time", None]}}
+                }
+            },
+            {
+                "$project": {
+                    "_id": 0,
+                    "player_name": "$_id",
+                    "id": 1,
+                    "height": 1,
+                    "games_played": 1,
+                    "completions": 1,
+                    # $min on a stored null would never be replaced, so leave the field out instead
+                    "best_time": {"$ifNull": ["$best_time", "$$REMOVE"]}
+                }
+            },
+            {"$out": "player_stats"}
+        ]
+        await self.db.game_scores.aggregate(pipeline).to_list(None)
+        return await self.db.player_stats.count_documents({})
+
+    async def rebuild_game_stats(self):
+        scores = await self.db.game_scores.aggregate([
+            {
+                "$group": {
+                    "_id": None,
+                    "total_plays": {"$sum": 1},
+                    "height_sum": {"$sum": "$height"},
+                    "completions": {"$sum": {"$cond": ["$completed", 1, 0]}}
+                }
+            }
+        ]).to_list(1)
+        sessions = await self.db.game_sessions.aggregate([
+            {"$group": {"_id": None, "play_time": {"$sum": "$play_time"}}}
+        ]).to_list(1)
+
+        counters = dict.fromkeys(GAME_STATS_FIELDS, 0)
+        for result in scores + sessions:
+            result.pop("_id")
+            counters.update(result)
+
+        await self.db.game_stats.replace_one({"_id": GLOBAL_STATS_ID}, counters, upsert=True)
+        return counters
+
+    def cache_version_store(self):
+        return MongoVersionStore(self)
+
+    async def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+            self._write_dbs = {}
+
+
+class MongoVersionStore:
+    """coherence.CacheCoherence's version-stamp document, in the cache_versions collection"""
+
+    can_watch = True
+    DOCUMENT_ID = "cache"
+
+    def __init__(self, repository: MotorRepository):
+        self.repository = repository
+
+    @property
+    def collection(self):
+        return self.repository.db.cache_versions
+
+    async def bump(self, changes: List[dict], keep: int):
+        update = {"$inc": {"v": len(changes)}, "$push": {"changes": {"$each": changes, "$slice": -keep}}}
+        try:
+            await self.collection.update_one({"_id": self.DOCUMENT_ID}, update, upsert=True)
+        except DuplicateKeyError:
+            # Another worker created the document first; now it exists
+            await self.collection.update_one({"_id": self.DOCUMENT_ID}, update)
+
+    async def read(self, since: int):
+        document = await self.collection.find_one({"_id": self.DOCUMENT_ID, "v": {"$gt": since}})
+        return (document["v"], document["changes"]) if document else None
+
+    async def watch(self):
+        """Yield once the change stream is open, then on every update of the document
+
+        Raises on servers without change streams (standalone mongod).
+        """
+        pipeline = [{"$match": {"documentKey._id": self.DOCUMENT_ID}}]
+        async with self.collection.watch(pipeline) as stream:
+            # Changes made before the stream opened are picked up by this first sync
+            yield
+            async for _ in stream:
+                yield
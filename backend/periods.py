@@ -0,0 +1,50 @@
+"""
+Calendar periods behind the daily, weekly and monthly leaderboards.
+
+Each score is folded into one bucket per window, keyed by the window and the
+start of the period it falls in (e.g. "week:2026-10-12"), so the board of
+the current period is a single indexed read. Buckets carry an expires_at
+some time after their period ends, for a TTL index to remove.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+WINDOWS = ("day", "week", "month")
+
+# How long a bucket is kept after its period ends
+PERIOD_RETENTION = timedelta(days=float(os.environ.get("LEADERBOARD_PERIOD_RETENTION_DAYS", "35")))
+
+
+def period_start(window: str, when: datetime) -> datetime:
+    day = datetime(when.year, when.month, when.day)
+    if window == "day":
+        return day
+    if window == "week":
+        # Weeks start on Monday
+        return day - timedelta(days=day.weekday())
+    if window == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Unknown leaderboard window {window!r}")
+
+
+def period_end(window: str, start: datetime) -> datetime:
+    if window == "day":
+        return start + timedelta(days=1)
+    if window == "week":
+        return start + timedelta(weeks=1)
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def period_key(window: str, when: datetime) -> str:
+    """Bucket key of the period of a window containing when"""
+    return f"{window}:{period_start(window, when).date().isoformat()}"
+
+
+def period_buckets(when: datetime) -> List[Tuple[str, datetime]]:
+    """(key, expires_at) of the bucket in every window a score made at when belongs to"""
+    buckets = []
+    for window in WINDOWS:
+        start = period_start(window, when)
+        buckets.append((f"{window}:{start.date().isoformat()}", period_end(window, start) + PERIOD_RETENTION))
+    return buckets
@@ -0,0 +1,190 @@
+"""
+Order-statistics index over the leaderboard.
+
+RankIndex keeps every player in leaderboard order in an indexable skip list:
+each forward link stores how many entries it jumps over, so finding a
+player's rank, reading the entry at a rank, or seeking to a keyset cursor
+all take O(log n), and score submissions update it in place.
+"""
+import base64
+import json
+import random
+from typing import AsyncIterable, Dict, List, Optional, Tuple
+
+MAX_LEVEL = 32
+
+
+def rank_key(player_name: str, height: int, completions: int) -> Tuple[int, int, str]:
+    """Leaderboard order: highest first, then most completions, then by name"""
+    return (-height, -completions, player_name)
+
+
+def encode_cursor(key: Tuple[int, int, str]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int, str]:
+    """Key of the last entry of the previous page; ValueError if malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        height, completions, player_name = json.loads(base64.urlsafe_b64decode(padded))
+        return (int(height), int(completions), str(player_name))
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+class _Node:
+    __slots__ = ("key", "entry", "next", "width")
+
+    def __init__(self, key, entry, level: int):
+        self.key = key
+        self.entry = entry
+        self.next: List[Optional["_Node"]] = [None] * level
+        # Entries skipped by each forward link, counting its target
+        self.width = [1] * level
+
+
+class RankIndex:
+    """Indexable skip list of leaderboard entries keyed by rank_key"""
+
+    def __init__(self):
+        self._head = _Node(None, None, MAX_LEVEL)
+        self._level = 1
+        self._keys: Dict[str, Tuple[int, int, str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @staticmethod
+    def _random_level() -> int:
+        level = 1
+        while level < MAX_LEVEL and random.random() < 0.5:
+            level += 1
+        return level
+
+    def _search(self, key):
+        """Last node before key on every level, with its 0-based position"""
+        update = [self._head] * MAX_LEVEL
+        positions = [-1] * MAX_LEVEL
+        node, position = self._head, -1
+        for level in range(self._level - 1, -1, -1):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            update[level] = node
+            positions[level] = position
+        return update, positions
+
+    def update(self, player_name: str, height: int, completions: int, **fields):
+        """Insert a player or move them to the rank of their new stats"""
+        self.remove(player_name)
+        key = rank_key(player_name, height, completions)
+        entry = {"name": player_name, "height": height, "completions": completions, **fields}
+        update, positions = self._search(key)
+
+        level = self._random_level()
+        if level > self._level:
+            for extra in range(self._level, level):
+                update[extra] = self._head
+                positions[extra] = -1
+                self._head.width[extra] = len(self._keys) + 1
+            self._level = level
+
+        node = _Node(key, entry, level)
+        position = positions[0] + 1
+        for i in range(level):
+            previous = update[i]
+            node.next[i] = previous.next[i]
+            previous.next[i] = node
+            skipped = position - positions[i]
+            node.width[i] = previous.width[i] - skipped + 1
+            previous.width[i] = skipped
+        for i in range(level, self._level):
+            update[i].width[i] += 1
+        self._keys[player_name] = key
+
+    def remove(self, player_name: str):
+        key = self._keys.pop(player_name, None)
+        if key is None:
+            return
+        update, _ = self._search(key)
+        node = update[0].next[0]
+        for i in range(self._level):
+            if update[i].next[i] is node:
+                update[i].width[i] += node.width[i] - 1
+                update[i].next[i] = node.next[i]
+            else:
+                update[i].width[i] -= 1
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+
+    def key_of(self, player_name: str) -> Optional[Tuple[int, int, str]]:
+        """A player's rank_key, None if unranked"""
+        return self._keys.get(player_name)
+
+    def rank(self, player_name: str) -> Optional[int]:
+        """1-based rank of a player, None if unranked"""
+        key = self._keys.get(player_name)
+        if key is None:
+            return None
+        _, positions = self._search(key)
+        return positions[0] + 2
+
+    def _node_at(self, index: int) -> Optional[_Node]:
+        """Node at a 0-based position"""
+        if index < 0 or index >= len(self._keys):
+            return None
+        node, position = self._head, -1
+        for level in range(self._level - 1, -1, -1):
+            while node.next[level] is not None and position + node.width[level] <= index:
+                position += node.width[level]
+                node = node.next[level]
+        return node
+
+    def _walk(self, node: Optional[_Node], rank: int, limit: int) -> List[dict]:
+        entries = []
+        while node is not None and len(entries) < limit:
+            entries.append({"rank": rank, **node.entry})
+            node = node.next[0]
+            rank += 1
+        return entries
+
+    def slice(self, start: int, limit: int) -> List[dict]:
+        """Up to limit entries starting at a 0-based position, with their ranks"""
+        return self._walk(self._node_at(start), start + 1, limit)
+
+    def around(self, player_name: str, radius: int) -> Tuple[Optional[int], List[dict]]:
+        """A player's rank and the entries up to radius ranks either side"""
+        rank = self.rank(player_name)
+        if rank is None:
+            return None, []
+        start = max(0, rank - 1 - radius)
+        return rank, self.slice(start, rank - start + radius)
+
+    def page(self, after: Optional[Tuple[int, int, str]], limit: int) -> Tuple[List[dict], Optional[str]]:
+        """Entries strictly after a cursor key, and the cursor for the next page"""
+        if after is None:
+            entries = self.slice(0, limit)
+        else:
+            update, positions = self._search(after)
+            node, rank = update[0].next[0], positions[0] + 2
+            if node is not None and node.key == after:
+                node, rank = node.next[0], rank + 1
+            entries = self._walk(node, rank, limit)
+        next_cursor = None
+        if len(entries) == limit and entries[-1]["rank"] < len(self._keys):
+            last = entries[-1]
+            next_cursor = encode_cursor(rank_key(last["name"], last["height"], last["completions"]))
+        return entries, next_cursor
+
+    async def load(self, player_stats: AsyncIterable[dict]):
+        """Rebuild the index from every player's stats document"""
+        self.__init__()
+        async for stats in player_stats:
+            self.update(
+                stats["player_name"],
+                stats.get("height", 0),
+                stats.get("completions", 0),
+                id=stats.get("id", ""),
+                best_time=stats.get("best_time")
+            )
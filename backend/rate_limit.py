@@ -0,0 +1,215 @@
+"""
+Admission control for the write endpoints.
+
+Each limited route has token buckets keyed by player and by client IP; a
+request spends one token per write from both and is refused with 429 and a
+Retry-After when either is empty. A request costing more than a full bucket
+could never pass and is refused with 413 instead. Tokens are only taken once
+every bucket concerned admits the request, so a refused request costs
+nothing. Buckets live in an LRU bounded by max_keys, so the least recently seen key is dropped first; a bucket idle for
+burst / rate seconds is full again anyway, so dropping it loses nothing.
+
+Independently of the buckets, WriteGate caps how many database-bound writes
+run at once across every route. A write arriving at the cap is shed with 429
+straight away instead of waiting in an unbounded queue behind the others.
+"""
+import math
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from starlette.requests import HTTPConnection
+
+
+def parse_rate(value: Optional[str]) -> Optional[Tuple[float, float]]:
+    """(requests per second, burst) from "rate" or "rate:burst"; None when empty or 0, meaning unlimited"""
+    if not value:
+        return None
+    rate, _, burst = value.partition(":")
+    rate = float(rate)
+    if rate <= 0:
+        return None
+    burst = float(burst) if burst else max(1.0, rate)
+    if burst < 1:
+        raise ValueError(f"Rate limit burst must be at least 1, got {value!r}")
+    return rate, burst
+
+
+class RateLimiter:
+    """Token buckets per key, refilled at rate tokens per second up to burst"""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> [tokens, time of last refill], least recently used first
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self.evictions = 0
+
+    def _refill(self, key: str, now: float) -> list:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        return bucket
+
+    def wait(self, key: str, cost: float = 1, now: Optional[float] = None) -> float:
+        """Seconds until cost tokens are available, 0 if they are now; takes nothing
+
+        cost must not exceed burst, or the tokens never become available.
+        """
+        bucket = self._refill(key, time.monotonic() if now is None else now)
+        return max(0.0, (cost - bucket[0]) / self.rate)
+
+    def take(self, key: str, cost: float = 1, now: Optional[float] = None):
+        """Spend cost tokens, which wait() has just found available"""
+        self._refill(key, time.monotonic() if now is None else now)[0] -= cost
+
+    def acquire(self, key: str, cost: float = 1, now: Optional[float] = None) -> float:
+        """Take cost tokens; 0 if admitted, else seconds until they will be available"""
+        wait = self.wait(key, cost, now)
+        if not wait:
+            self.take(key, cost, now)
+        return wait
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class RouteLimit:
+    """Per-player and per-IP buckets of one route; either may be None for no limit"""
+
+    def __init__(self, player: Optional[Tuple[float, float]], ip: Optional[Tuple[float, float]],
+                 max_keys: int = 100000):
+        self.player = RateLimiter(*player, max_keys=max_keys) if player else None
+        self.ip = RateLimiter(*ip, max_keys=max_keys) if ip else None
+        self.limited = 0
+
+    def charges(self, player_key: Optional[str], client_ip: Optional[str], cost: float = 1) -> List[tuple]:
+        """(route limit, bucket, key, cost) for each bucket a request spends from"""
+        charges = []
+        if self.ip is not None and client_ip is not None:
+            charges.append((self, self.ip, client_ip, cost))
+        if self.player is not None and player_key is not None:
+            charges.append((self, self.player, player_key, cost))
+        return charges
+
+    def stats(self) -> dict:
+        return {
+            "limited": self.limited,
+            "players": len(self.player) if self.player is not None else 0,
+            "ips": len(self.ip) if self.ip is not None else 0,
+            "evictions": sum(limiter.evictions for limiter in (self.player, self.ip) if limiter is not None),
+        }
+
+
+class WriteGate:
+    """Caps concurrent database-bound writes; 0 disables the cap"""
+
+    def __init__(self, max_concurrent: int = 0, retry_after: float = 1.0):
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        self.active = 0
+        self.shed = 0
+
+    def try_enter(self) -> bool:
+        if self.max_concurrent and self.active >= self.max_concurrent:
+            self.shed += 1
+            return False
+        self.active += 1
+        return True
+
+    def leave(self):
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {"max_concurrent": self.max_concurrent, "active": self.active, "shed": self.shed}
+
+
+def too_many_requests(retry_after: float, detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+def too_large(cost: float, max_cost: float) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Request needs {cost:g} writes but the rate limit allows at most {max_cost:g} at once"
+    )
+
+
+class AdmissionControl:
+    """Rate limits per route plus the shared write gate
+
+    With trust_forwarded_for, the client IP is the last X-Forwarded-For hop,
+    the one added by the proxy in front of the app; otherwise it is the peer
+    address, which behind a proxy is the proxy itself.
+    """
+
+    def __init__(self, routes: Dict[str, RouteLimit], gate: WriteGate, trust_forwarded_for: bool = False):
+        self.routes = routes
+        self.gate = gate
+        self.trust_forwarded_for = trust_forwarded_for
+
+    def client_ip(self, request: HTTPConnection) -> str:
+        if self.trust_forwarded_for:
+            forwarded = request.headers.get("x-forwarded-for")
+            if forwarded:
+                return forwarded.rsplit(",", 1)[-1].strip()
+        return request.client.host if request.client else "unknown"
+
+    @contextmanager
+    def admit(self, route: str, request: Optional[HTTPConnection], player_key: Optional[str] = None, cost: float = 1,
+              player_route: Optional[str] = None, player_costs: Optional[Dict[str, float]] = None):
+        """Raise 413 or 429 if the route's limits or the write gate refuse, else hold a write slot
+
+        request is the HTTP request or WebSocket the write arrived on. Without
+        one (an endpoint called from inside the process) only the write gate
+        applies. A request writing for several players, e.g. a batch of
+        scores, also spends player_costs from player_route's player buckets.
+        """
+        charges = []
+        if request is not None:
+            limit = self.routes.get(route)
+            if limit is not None:
+                charges.extend(limit.charges(player_key, self.client_ip(request), cost))
+            players = self.routes.get(player_route)
+            if players is not None and player_costs:
+                for key, player_cost in player_costs.items():
+                    charges.extend(players.charges(key, None, player_cost))
+
+        for _, bucket, _, charge in charges:
+            if charge > bucket.burst:
+                raise too_large(charge, bucket.burst)
+        now = time.monotonic()
+        waits = [(limit, bucket.wait(key, charge, now)) for limit, bucket, key, charge in charges]
+        refused = {limit for limit, wait in waits if wait}
+        if refused:
+            for limit in refused:
+                limit.limited += 1
+            raise too_many_requests(max(wait for _, wait in waits), "Rate limit exceeded")
+        if not self.gate.try_enter():
+            raise too_many_requests(self.gate.retry_after, "Server busy, retry shortly")
+        for _, bucket, key, charge in charges:
+            bucket.take(key, charge, now)
+        try:
+            yield
+        finally:
+            self.gate.leave()
+
+    def stats(self) -> dict:
+        return {
+            "write_gate": self.gate.stats(),
+            "routes": {route: limit.stats() for route, limit in self.routes.items()},
+        }
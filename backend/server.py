@@ -1,21 +1,96 @@
-from fastapi import FastAPI, APIRouter
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, APIRouter, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
+import signal
+import threading
 from pathlib import Path
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+from settings import env_flag
+from storage import create_repository
+from metrics import MetricsMiddleware, MetricsRegistry
+from db_metrics import CommandStatsListener, DBStatsMiddleware, DBStatsRegistry
+
+# MongoDB command instrumentation; commands slower than SLOW_QUERY_MS are logged
+db_listener = CommandStatsListener(slow_ms=float(os.environ.get("SLOW_QUERY_MS", "100")))
+
+# Storage backend: MongoDB by default, STORAGE_BACKEND=memory for an in-process store.
+# The MongoDB client is only created when the app starts, see lifespan()
+repository = create_repository(os.environ.get("STORAGE_BACKEND", "mongo"), event_listeners=[db_listener])
+
+# Seconds shutdown waits for in-flight requests before closing the database
+SHUTDOWN_DRAIN_SECONDS = float(os.environ.get("SHUTDOWN_DRAIN_SECONDS", "10"))
+
+# Set once startup has connected and loaded everything, cleared when shutdown begins
+ready = False
+
+def begin_shutdown():
+    """Stop reporting ready and end open leaderboard streams"""
+    global ready
+    ready = False
+    leaderboard_stream.close()
+
+def begin_shutdown_on_signal():
+    """Run begin_shutdown() as soon as the server receives SIGINT or SIGTERM
+
+    uvicorn waits for open connections to finish before it runs the lifespan
+    shutdown, so streams only closed there would hold shutdown open until
+    --timeout-graceful-shutdown. This chains onto the handlers the server
+    installed before startup; servers that installed none are left alone.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        previous = signal.getsignal(signum)
+        if not callable(previous):
+            continue
+
+        def handler(received, frame, previous=previous):
+            # Signal handlers run between bytecodes; let the loop do the work
+            loop.call_soon_threadsafe(begin_shutdown)
+            previous(received, frame)
+
+        signal.signal(signum, handler)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global ready
+    # Fail fast if the database is unreachable, and open the pool before traffic arrives
+    await repository.connect()
+    # Opt-in: refuse to start if a hot query would fall back to a collection scan
+    verify = env_flag("VERIFY_QUERY_PLANS")
+    await repository.ensure_indexes(verify=verify)
+    await load_rank_index()
+    await cache_coherence.start()
+    start_rank_index_refresh()
+    achievement_worker.start()
+    session_buffer.start()
+    begin_shutdown_on_signal()
+    ready = True
+
+    yield
+
+    # Usually done already when the shutdown signal arrived
+    begin_shutdown()
+    if not await metrics_registry.wait_idle(SHUTDOWN_DRAIN_SECONDS):
+        logger.warning("Shutting down with %d requests still in flight", metrics_registry.in_flight)
+    # Finish queued achievement evaluations while the database is still open
+    await achievement_worker.drain()
+    await session_buffer.stop()
+    # Publish the last changes, including the buffer's final flush
+    await stop_rank_index_refresh()
+    await cache_coherence.stop()
+    await repository.close()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 from starlette.middleware.cors import CORSMiddleware # JÁ IMPORTADO NA LINHA 3
 
 # Endereço do seu frontend (Vercel)
@@ -28,6 +103,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],           # Permite todos os métodos (GET, POST, etc.)
     allow_headers=["*"],           # Permite todos os cabeçalhos
+    expose_headers=["ETag", "Retry-After"],  # Lidos pelo GameAPI (requisições condicionais e 429)
 )
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -37,8 +113,29 @@ api_router = APIRouter(prefix="/api")
 async def root():
     return {"message": "Plastic Bag King API is running!"}
 
+# Readiness for load balancers: 503 until startup finishes and once shutdown starts
+@api_router.get("/ready")
+async def readiness():
+    if not ready:
+        return Response(status_code=503, content='{"ready":false}', media_type="application/json")
+    return {"ready": True}
+
+# Per-route request metrics in Prometheus format
+metrics_registry = MetricsRegistry()
+db_stats_registry = DBStatsRegistry()
+
+@api_router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(
+        content=metrics_registry.render() + db_stats_registry.render(db_listener),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
 # Import and include game routes
-from game_routes import game_router
+from game_routes import (
+    game_router, achievement_worker, session_buffer, leaderboard_stream, load_rank_index, cache_coherence,
+    start_rank_index_refresh, stop_rank_index_refresh
+)
 
 # Include the API router with health check
 app.include_router(api_router, tags=["health"])
@@ -53,15 +150,23 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Retry-After"],
 )
 
+# Per-request database command counts; DEBUG_DB_STATS adds them as response headers
+app.add_middleware(
+    DBStatsMiddleware,
+    registry=db_stats_registry,
+    route_template=metrics_registry.route_template,
+    debug=env_flag("DEBUG_DB_STATS")
+)
+
+# Outermost middleware, so the latency covers the whole stack
+app.add_middleware(MetricsMiddleware, registry=metrics_registry)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SessionWriteBuffer:
+    """Write-behind buffer coalescing session progress updates
+
+    update() keeps only the latest fields per session in memory; a periodic
+    task (or a full buffer) flushes them with one bulk write, so a client
+    reporting progress many times per interval costs one write. The global
+    play time counter is advanced by what each session gained since it was
+    last written.
+    """
+
+    def __init__(self, repository, enabled: bool = False, flush_interval: float = 1.0, max_size: int = 1000,
+                 on_flush: Optional[Callable[[], None]] = None):
+        self.repository = repository
+        # Called after a flush has written sessions
+        self.on_flush = on_flush
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        # session_id -> {"fields": latest fields, "play_time": play time already stored}
+        self._entries: Dict[str, dict] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self.updates = 0
+        self.flushes = 0
+        self.written = 0
+
+    async def update(self, session_id: str, fields: dict) -> bool:
+        """Buffer an update; False if the session does not exist"""
+        entry = self._entries.get(session_id)
+        if entry is None:
+            if self._flush_lock.locked():
+                # Read the session only after an in-flight flush has written it
+                async with self._flush_lock:
+                    pass
+            stored = await self.repository.get_session(session_id)
+            if stored is None:
+                return False
+            # Another update for this session may have been buffered while reading
+            entry = self._entries.setdefault(
+                session_id, {"fields": {}, "play_time": stored.get("play_time", 0)}
+            )
+        entry["fields"].update(fields)
+        self.updates += 1
+
+        if len(self._entries) >= self.max_size and not self._flush_lock.locked():
+            await self.flush()
+        return True
+
+    def pending(self, session_id: str) -> Optional[dict]:
+        """Buffered fields not yet written for a session"""
+        entry = self._entries.get(session_id)
+        return dict(entry["fields"]) if entry else None
+
+    async def get(self, session_id: str) -> Optional[dict]:
+        """Read a session as clients see it, buffered updates included"""
+        session = await self.repository.get_session(session_id)
+        pending = self.pending(session_id)
+        if session is not None and pending:
+            session.update(pending)
+        return session
+
+    async def flush(self):
+        """Write every buffered session in one bulk write"""
+        async with self._flush_lock:
+            entries, self._entries = self._entries, {}
+            if not entries:
+                return
+            try:
+                await self.repository.update_sessions({
+                    session_id: entry["fields"] for session_id, entry in entries.items()
+                })
+                play_time_delta = sum(
+                    entry["fields"].get("play_time", entry["play_time"]) - entry["play_time"]
+                    for entry in entries.values()
+                )
+                if play_time_delta:
+                    await self.repository.increment_game_stats(play_time=play_time_delta)
+            except Exception:
+                # Put the updates back under any newer ones so the next flush retries them
+                for session_id, entry in entries.items():
+                    newer = self._entries.get(session_id)
+                    if newer is not None:
+                        entry["fields"].update(newer["fields"])
+                    self._entries[session_id] = entry
+                raise
+            self.flushes += 1
+            self.written += len(entries)
+            if self.on_flush is not None:
+                self.on_flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Session buffer flush failed, will retry")
+
+    def start(self):
+        """Start the periodic flush task; must run inside the event loop"""
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info("Session write-behind enabled, flushing every %.2fs", self.flush_interval)
+
+    async def stop(self):
+        """Stop the periodic task and write whatever is still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "buffered": len(self._entries),
+            "updates": self.updates,
+            "flushes": self.flushes,
+            "written": self.written,
+        }
@@ -0,0 +1,11 @@
+"""
+Helpers for reading configuration from the environment.
+"""
+import os
+
+TRUE_VALUES = ("1", "true", "yes")
+
+
+def env_flag(name: str) -> bool:
+    """True if an environment variable is set to 1, true or yes (any case)"""
+    return os.environ.get(name, "").lower() in TRUE_VALUES
@@ -0,0 +1,335 @@
+"""
+Storage layer for the game backend.
+
+GameRepository is the interface game_routes.py talks to. MotorRepository
+(mongo_storage.py) keeps the data in MongoDB; MemoryRepository keeps it in
+indexed dicts and a sorted leaderboard inside the process, for tests, load
+runs and profiling the app without database latency. create_repository()
+picks one from STORAGE_BACKEND, importing the MongoDB driver only when it is
+the one picked.
+"""
+import copy
+from abc import ABC, abstractmethod
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from achievements import ACHIEVEMENT_BITS, decode_unlocks
+
+# Single document in game_stats holding the global counters
+GLOBAL_STATS_ID = "global"
+
+# Leaderboard ordering over the player_stats collection; ties go by name, as in ranking.rank_key
+LEADERBOARD_SORT = [("height", -1), ("completions", -1), ("player_name", 1)]
+
+GAME_STATS_FIELDS = ("total_plays", "height_sum", "completions", "play_time")
+
+
+class GameRepository(ABC):
+    """Operations the request path needs from storage
+
+    Engines must implement every abstract method; the rest have defaults.
+    """
+
+    # Scores
+    @abstractmethod
+    async def insert_score(self, score: dict):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def insert_scores(self, scores: List[dict]) -> Dict[int, str]:
+        """Insert scores independently; return {index: error} for the ones that failed"""
+        raise NotImplementedError
+
+    # Per-player stats
+    @abstractmethod
+    async def fold_player_stats(self, player_name: str, score_id: str, height: int, games_played: int,
+                                completions: int, best_time: Optional[int]) -> Optional[dict]:
+        """Atomically fold scores into a player's stats and return the previous document"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_player_stats(self, player_name: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def top_players(self, limit: int) -> List[dict]:
+        """Player stats in leaderboard order"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def scan_player_stats(self) -> AsyncIterator[dict]:
+        """Every player's stats, in no particular order"""
+        raise NotImplementedError
+
+    # Time-windowed leaderboards
+    @abstractmethod
+    async def fold_period_stats(self, periods: List[Tuple[str, datetime]], player_name: str, score_id: str,
+                                height: int, games_played: int, completions: int, best_time: Optional[int]):
+        """Fold scores into a player's bucket of each (period key, expires_at)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def top_period_players(self, period: str, limit: int) -> List[dict]:
+        """Player stats of one period bucket in leaderboard order"""
+        raise NotImplementedError
+
+    # Global stats
+    @abstractmethod
+    async def get_game_stats(self) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def increment_game_stats(self, **deltas):
+        raise NotImplementedError
+
+    # Sessions
+    @abstractmethod
+    async def insert_session(self, session: dict):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_session(self, session_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def update_session(self, session_id: str, fields: dict) -> Optional[dict]:
+        """Set fields on a session and return its previous state, or None if it does not exist"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def update_sessions(self, updates: Dict[str, dict]):
+        """Set fields on many sessions at once, keyed by session id"""
+        raise NotImplementedError
+
+    # Achievements
+    @abstractmethod
+    async def get_unlocks(self, player_name: str) -> Dict[str, datetime]:
+        """Map of achievement id to unlock time for a player"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def add_unlocks(self, player_name: str, achievement_ids: List[str]) -> Dict[str, datetime]:
+        """Idempotently unlock achievements; return the ids this call actually unlocked with their stored times"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def migrate_unlocks(self) -> dict:
+        """Convert unlocks stored one document per achievement into per-player masks"""
+        raise NotImplementedError
+
+    # Maintenance
+    async def ensure_indexes(self, verify: bool = False):
+        pass
+
+    @abstractmethod
+    async def rebuild_player_stats(self) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def rebuild_game_stats(self) -> dict:
+        raise NotImplementedError
+
+    def cache_version_store(self):
+        """Shared store for coherence.CacheCoherence, None if the engine cannot be shared between processes"""
+        return None
+
+    async def connect(self):
+        """Open connections and check the storage is reachable"""
+        pass
+
+    async def close(self):
+        pass
+
+
+class MemoryRepository(GameRepository):
+    """Pure-Python storage in indexed dicts and a sorted leaderboard
+
+    Every method runs without awaiting, so each one is atomic with respect to
+    other requests on the event loop, like a single MongoDB operation.
+    """
+
+    def __init__(self):
+        self.scores: List[dict] = []
+        self.scores_by_player: Dict[str, List[dict]] = {}
+        self.player_stats: Dict[str, dict] = {}
+        # (-height, -completions, player_name) for every player, kept sorted
+        self.leaderboard: List[tuple] = []
+        # period -> player_name -> stats, with a sorted board and expiry per period
+        self.period_stats: Dict[str, Dict[str, dict]] = {}
+        self.period_boards: Dict[str, List[tuple]] = {}
+        self.period_expiry: Dict[str, datetime] = {}
+        self.game_stats = dict.fromkeys(GAME_STATS_FIELDS, 0)
+        self.sessions: Dict[str, dict] = {}
+        # player_name -> {"mask": unlocked bits, "ts": {bit: unlock time}}, as in player_unlocks
+        self.unlocks: Dict[str, dict] = {}
+
+    async def insert_score(self, score):
+        self._insert_score(score)
+
+    async def insert_scores(self, scores):
+        for score in scores:
+            self._insert_score(score)
+        return {}
+
+    def _insert_score(self, score):
+        score = dict(score)
+        self.scores.append(score)
+        self.scores_by_player.setdefault(score["player_name"], []).append(score)
+
+    async def fold_player_stats(self, player_name, score_id, height, games_played, completions, best_time):
+        stats = self.player_stats.get(player_name)
+        previous = copy.copy(stats)
+        if stats is None:
+            stats = self.player_stats[player_name] = {
+                "player_name": player_name, "id": score_id, "height": height,
+                "games_played": 0, "completions": 0
+            }
+        else:
+            self._unrank(stats)
+            stats["height"] = max(stats["height"], height)
+
+        stats["games_played"] += games_played
+        stats["completions"] += completions
+        if best_time is not None and ("best_time" not in stats or best_time < stats["best_time"]):
+            stats["best_time"] = best_time
+        insort(self.leaderboard, self._rank_key(stats))
+        return previous
+
+    @staticmethod
+    def _rank_key(stats):
+        return (-stats["height"], -stats["completions"], stats["player_name"])
+
+    def _unrank(self, stats):
+        del self.leaderboard[bisect_left(self.leaderboard, self._rank_key(stats))]
+
+    async def get_player_stats(self, player_name):
+        return copy.copy(self.player_stats.get(player_name))
+
+    async def top_players(self, limit):
+        return [dict(self.player_stats[key[2]]) for key in self.leaderboard[:limit]]
+
+    async def scan_player_stats(self):
+        for stats in list(self.player_stats.values()):
+            yield dict(stats)
+
+    async def fold_period_stats(self, periods, player_name, score_id, height, games_played, completions, best_time):
+        self._expire_periods()
+        for period, expires_at in periods:
+            players = self.period_stats.setdefault(period, {})
+            board = self.period_boards.setdefault(period, [])
+            self.period_expiry[period] = max(expires_at, self.period_expiry.get(period, expires_at))
+
+            stats = players.get(player_name)
+            if stats is None:
+                stats = players[player_name] = {
+                    "period": period, "player_name": player_name, "id": score_id, "height": height,
+                    "games_played": 0, "completions": 0
+                }
+            else:
+                del board[bisect_left(board, self._rank_key(stats))]
+                stats["height"] = max(stats["height"], height)
+
+            stats["games_played"] += games_played
+            stats["completions"] += completions
+            if best_time is not None and ("best_time" not in stats or best_time < stats["best_time"]):
+                stats["best_time"] = best_time
+            insort(board, self._rank_key(stats))
+
+    def _expire_periods(self):
+        now = datetime.utcnow()
+        for period, expires_at in list(self.period_expiry.items()):
+            if expires_at <= now:
+                del self.period_expiry[period], self.period_stats[period], self.period_boards[period]
+
+    async def top_period_players(self, period, limit):
+        players = self.period_stats.get(period, {})
+        return [dict(players[key[2]]) for key in self.period_boards.get(period, [])[:limit]]
+
+    async def get_game_stats(self):
+        return dict(self.game_stats)
+
+    async def increment_game_stats(self, **deltas):
+        for field, delta in deltas.items():
+            self.game_stats[field] = self.game_stats.get(field, 0) + delta
+
+    async def insert_session(self, session):
+        self.sessions[session["id"]] = dict(session)
+
+    async def get_session(self, session_id):
+        return copy.copy(self.sessions.get(session_id))
+
+    async def update_session(self, session_id, fields):
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        previous = dict(session)
+        session.update(fields)
+        return previous
+
+    async def update_sessions(self, updates):
+        for session_id, fields in updates.items():
+            if session_id in self.sessions:
+                self.sessions[session_id].update(fields)
+
+    async def get_unlocks(self, player_name):
+        unlocks = self.unlocks.get(player_name)
+        if unlocks is None:
+            return {}
+        return decode_unlocks(unlocks["mask"], unlocks["ts"])
+
+    async def add_unlocks(self, player_name, achievement_ids):
+        unlocks = self.unlocks.setdefault(player_name, {"mask": 0, "ts": {}})
+        now = datetime.utcnow()
+        created = {}
+        for achievement_id in achievement_ids:
+            bit = ACHIEVEMENT_BITS[achievement_id]
+            if not unlocks["mask"] >> bit & 1:
+                unlocks["mask"] |= 1 << bit
+                unlocks["ts"][str(bit)] = now
+                created[achievement_id] = now
+        return created
+
+    async def migrate_unlocks(self):
+        # Unlocks have only ever been kept as masks in memory
+        return {"players": 0, "unlocks": 0, "skipped": 0}
+
+    async def rebuild_player_stats(self):
+        self.player_stats = {}
+        self.leaderboard = []
+        for player_name, scores in self.scores_by_player.items():
+            for score in sorted(scores, key=lambda s: s["created_at"]):
+                completed = score.get("completed", False)
+                await self.fold_player_stats(
+                    player_name, score["id"], score["height"], 1, 1 if completed else 0,
+                    score.get("completion_time") if completed else None
+                )
+        return len(self.player_stats)
+
+    async def rebuild_game_stats(self):
+        self.game_stats = {
+            "total_plays": len(self.scores),
+            "height_sum": sum(score["height"] for score in self.scores),
+            "completions": sum(1 for score in self.scores if score.get("completed")),
+            "play_time": sum(session.get("play_time", 0) for session in self.sessions.values()),
+        }
+        return dict(self.game_stats)
+
+
+def _mongo_repository(**client_options) -> GameRepository:
+    from mongo_storage import MotorRepository
+    return MotorRepository.from_env(**client_options)
+
+
+STORAGE_BACKENDS = {
+    "mongo": _mongo_repository,
+    "memory": lambda **client_options: MemoryRepository(),
+}
+
+
+def create_repository(backend: str, **client_options) -> GameRepository:
+    """Build the repository for a STORAGE_BACKEND name; client_options go to the Mongo client"""
+    backend = backend.lower()
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}, expected one of {', '.join(STORAGE_BACKENDS)}")
+    return STORAGE_BACKENDS[backend](**client_options)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Load test and latency benchmark for the Plastic Bag King backend.
+
+Drives a mixed workload (score submits, leaderboard reads, session updates and
+achievement reads) with configurable concurrency, either against the FastAPI
+app in-process or against a running server, and reports throughput and
+p50/p95/p99 latency per endpoint.
+
+Examples:
+    # In-process on the in-memory storage engine, 50 concurrent clients for 20s
+    python backend_benchmark.py --storage memory --concurrency 50 --duration 20
+
+    # Against a local server, saving machine-readable results for comparison
+    python backend_benchmark.py --url http://localhost:8001 --output bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent / "backend"
+
+DEFAULT_MIX = "submit=4,leaderboard=4,session=2,achievements=1"
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in WORKLOADS:
+            raise argparse.ArgumentTypeError(f"Unknown workload {name!r}, expected one of {', '.join(WORKLOADS)}")
+        weights[name] = int(weight or 1)
+    return weights
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Latencies and error counts per endpoint template"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(self, endpoint: str, seconds: float, ok: bool):
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict[str, dict]:
+        endpoints = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            endpoints[endpoint] = {
+                "requests": len(values),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput_rps": round(len(values) / elapsed, 1),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+                "max_ms": round(values[-1] * 1000, 2),
+            }
+        return endpoints
+
+
+class VirtualPlayer:
+    """One concurrent client playing as a player from the shared pool"""
+
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, player_name: str):
+        self.client = client
+        self.recorder = recorder
+        self.player_name = player_name
+        self.session_id = None
+        self.height = 0
+        self.play_time = 0
+
+    async def request(self, endpoint: str, method: str, path: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            response, ok = None, False
+        self.recorder.record(endpoint, time.perf_counter() - started, ok)
+        return response
+
+    async def submit(self):
+        completed = random.random() < 0.1
+        await self.request("POST /api/scores", "POST", "/api/scores", json={
+            "player_name": self.player_name,
+            "height": 300 if completed else random.randint(0, 299),
+            "completed": completed,
+            "completion_time": random.randint(120, 900) if completed else None,
+        })
+
+    async def leaderboard(self):
+        await self.request("GET /api/leaderboard", "GET", "/api/leaderboard", params={"limit": 10})
+
+    async def session(self):
+        if self.session_id is None:
+            response = await self.request(
+                "POST /api/session/start", "POST", "/api/session/start", json={"player_name": self.player_name}
+            )
+            if response is None or response.status_code >= 400:
+                return
+            self.session_id = response.json()["session_id"]
+            self.height = self.play_time = 0
+            return
+        self.height += random.randint(0, 5)
+        self.play_time += random.randint(1, 5)
+        await self.request("PUT /api/session/{session_id}", "PUT", f"/api/session/{self.session_id}", json={
+            "height": self.height, "completed": False, "play_time": self.play_time
+        })
+
+    async def achievements(self):
+        await self.request("GET /api/achievements/{player_name}", "GET", f"/api/achievements/{self.player_name}")
+
+
+WORKLOADS = {
+    "submit": VirtualPlayer.submit,
+    "leaderboard": VirtualPlayer.leaderboard,
+    "session": VirtualPlayer.session,
+    "achievements": VirtualPlayer.achievements,
+}
+
+
+async def drive(client: httpx.AsyncClient, args) -> dict:
+    recorder = Recorder()
+    names = list(args.mix)
+    weights = [args.mix[name] for name in names]
+    deadline = time.perf_counter() + args.duration
+    budget = {"remaining": args.requests}
+
+    async def client_loop(index: int):
+        player = VirtualPlayer(client, recorder, f"bench-player-{index % args.players}")
+        while time.perf_counter() < deadline:
+            if args.requests:
+                if budget["remaining"] <= 0:
+                    return
+                budget["remaining"] -= 1
+            workload = random.choices(names, weights)[0]
+            await WORKLOADS[workload](player)
+
+    # Warm-up requests are not recorded
+    warmup = VirtualPlayer(client, Recorder(), "bench-warmup")
+    for workload in WORKLOADS.values():
+        await workload(warmup)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop(index) for index in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    endpoints = recorder.summary(elapsed)
+    total = sum(stats["requests"] for stats in endpoints.values())
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "total_requests": total,
+        "total_errors": sum(stats["errors"] for stats in endpoints.values()),
+        "throughput_rps": round(total / elapsed, 1) if elapsed else 0.0,
+        "endpoints": endpoints,
+    }
+
+
+async def run_in_process(args) -> dict:
+    os.environ["STORAGE_BACKEND"] = args.storage
+    sys.path.insert(0, str(BACKEND_DIR))
+    from server import app
+
+    # Run the app's startup and shutdown hooks around the load
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            return await drive(client, args)
+
+
+async def run_against_url(args) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30.0) as client:
+        return await drive(client, args)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(results: dict):
+    print(f"{'endpoint':<40} {'reqs':>7} {'errs':>5} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for endpoint, stats in results["endpoints"].items():
+        print(f"{endpoint:<40} {stats['requests']:>7} {stats['errors']:>5} {stats['throughput_rps']:>8} "
+              f"{stats['p50_ms']:>8} {stats['p95_ms']:>8} {stats['p99_ms']:>8}")
+    print(f"\n{results['total_requests']} requests, {results['total_errors']} errors in "
+          f"{results['elapsed_s']}s ({results['throughput_rps']} req/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plastic Bag King backend load test")
+    parser.add_argument("--url", help="Benchmark a running server instead of the app in-process")
+    parser.add_argument("--storage", default="memory", choices=["memory", "mongo"],
+                        help="Storage backend for the in-process app (default: memory)")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent virtual clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests (0: no limit)")
+    parser.add_argument("--players", type=int, default=100, help="Distinct player names in the pool")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"Workload weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for a repeatable workload")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    results = asyncio.run(run_against_url(args) if args.url else run_in_process(args))
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "target": args.url or f"in-process ({args.storage})",
+        "config": {
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "requests": args.requests,
+            "players": args.players,
+            "mix": args.mix,
+            "seed": args.seed,
+        },
+        **results,
+    }
+
+    print_report(results)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
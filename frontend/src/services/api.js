@@ -3,17 +3,51 @@ import axios from 'axios';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Last ETag and body per URL, so unchanged reads come back as an empty 304
+const validators = new Map();
+
+const conditionalGet = async (url, params = {}) => {
+  const key = `${url}?${new URLSearchParams(params)}`;
+  const cached = validators.get(key);
+  const response = await axios.get(url, {
+    params,
+    headers: cached ? { 'If-None-Match': cached.etag } : {},
+    validateStatus: (status) => (status >= 200 && status < 300) || status === 304
+  });
+  if (response.status === 304 && cached) {
+    return cached.data;
+  }
+  if (response.headers.etag) {
+    validators.set(key, { etag: response.headers.etag, data: response.data });
+  }
+  return response.data;
+};
+
+// Retry a write once after the wait a 429 asks for, so a momentary limit does not lose a score
+const withRetryAfter = async (request) => {
+  try {
+    return await request();
+  } catch (error) {
+    const retryAfter = Number(error.response?.status === 429 && error.response.headers['retry-after']);
+    if (!retryAfter) {
+      throw error;
+    }
+    await new Promise((resolve) => setTimeout(resolve, retryAfter * 1000));
+    return request();
+  }
+};
+
 // Game API service
 class GameAPI {
   // Score management
   static async saveScore(playerName, height, completed = false, completionTime = null) {
     try {
-      const response = await axios.post(`${API}/scores`, {
+      const response = await withRetryAfter(() => axios.post(`${API}/scores`, {
         player_name: playerName,
         height: height,
         completed: completed,
         completion_time: completionTime
-      });
+      }));
       return response.data;
     } catch (error) {
       console.error('Error saving score:', error);
@@ -21,22 +55,53 @@ class GameAPI {
     }
   }
 
-  // Get leaderboard
-  static async getLeaderboard(limit = 10) {
+  // Get leaderboard, all-time or for the current 'day', 'week' or 'month'
+  static async getLeaderboard(limit = 10, window = null) {
     try {
-      const response = await axios.get(`${API}/leaderboard?limit=${limit}`);
-      return response.data;
+      return await conditionalGet(`${API}/leaderboard`, window ? { limit, window } : { limit });
     } catch (error) {
       console.error('Error fetching leaderboard:', error);
       throw error;
     }
   }
 
+  // Page through the whole board; pass the previous page's next_cursor
+  static async getLeaderboardPage(cursor = null, limit = 10) {
+    try {
+      const response = await axios.get(`${API}/leaderboard/page`, {
+        params: cursor ? { cursor, limit } : { limit }
+      });
+      return response.data;
+    } catch (error) {
+      console.error('Error fetching leaderboard page:', error);
+      throw error;
+    }
+  }
+
+  // A player's rank and the entries around them
+  static async getPlayerRank(playerName, radius = 5) {
+    try {
+      const response = await axios.get(`${API}/leaderboard/rank/${playerName}`, { params: { radius } });
+      return response.data;
+    } catch (error) {
+      console.error('Error fetching player rank:', error);
+      throw error;
+    }
+  }
+
+  // Live leaderboard: a snapshot first, then diffs as scores change the top
+  static subscribeLeaderboard(onSnapshot, onDiff) {
+    const source = new EventSource(`${API}/leaderboard/stream`);
+    source.addEventListener('snapshot', (event) => onSnapshot(JSON.parse(event.data)));
+    source.addEventListener('diff', (event) => onDiff(JSON.parse(event.data)));
+    source.onerror = (error) => console.error('Leaderboard stream error:', error);
+    return () => source.close();
+  }
+
   // Get game statistics
   static async getStats() {
     try {
-      const response = await axios.get(`${API}/stats`);
-      return response.data;
+      return await conditionalGet(`${API}/stats`);
     } catch (error) {
       console.error('Error fetching stats:', error);
       throw error;
@@ -70,11 +135,21 @@ class GameAPI {
     }
   }
 
+  // Stats, rank and achievements of a player in one request
+  static async getPlayerProfile(playerName) {
+    try {
+      const response = await axios.get(`${API}/players/${playerName}/profile`);
+      return response.data;
+    } catch (error) {
+      console.error('Error fetching player profile:', error);
+      throw error;
+    }
+  }
+
   // Achievement management
   static async getAchievements(playerName) {
     try {
-      const response = await axios.get(`${API}/achievements/${playerName}`);
-      return response.data;
+      return await conditionalGet(`${API}/achievements/${playerName}`);
     } catch (error) {
       console.error('Error fetching achievements:', error);
       throw error;
@@ -95,4 +170,62 @@ class GameAPI {
   }
 }
 
+// Live session over one WebSocket: start, progress and finish messages,
+// with achievement unlocks pushed back as they happen
+export class SessionSocket {
+  constructor({ onStarted, onAchievement, onFinished, onError } = {}) {
+    this.handlers = { onStarted, onAchievement, onFinished, onError };
+    this.queue = [];
+    this.socket = new WebSocket(`${API.replace(/^http/, 'ws')}/ws/session`);
+    this.socket.onopen = () => {
+      this.queue.forEach((message) => this.socket.send(message));
+      this.queue = [];
+    };
+    this.socket.onmessage = (event) => this.dispatch(JSON.parse(event.data));
+    this.socket.onerror = (error) => console.error('Session socket error:', error);
+  }
+
+  dispatch(message) {
+    const handler = {
+      started: this.handlers.onStarted,
+      achievement: this.handlers.onAchievement,
+      finished: this.handlers.onFinished,
+      error: this.handlers.onError
+    }[message.type];
+    if (handler) {
+      handler(message);
+    }
+  }
+
+  send(message) {
+    const data = JSON.stringify(message);
+    if (this.socket.readyState === WebSocket.OPEN) {
+      this.socket.send(data);
+    } else {
+      this.queue.push(data);
+    }
+  }
+
+  start(playerName = null) {
+    this.send({ type: 'start', player_name: playerName });
+  }
+
+  progress(height, playTime = 0) {
+    this.send({ type: 'progress', height: height, play_time: playTime });
+  }
+
+  finish(height, completed = false, playTime = 0, completionTime = null) {
+    const message = { type: 'finish', height: height, completed: completed, play_time: playTime };
+    // Without a completion time the server falls back to the play time
+    if (completionTime !== null) {
+      message.completion_time = completionTime;
+    }
+    this.send(message);
+  }
+
+  close() {
+    this.socket.close();
+  }
+}
+
 export default GameAPI;
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""
+Stress test for achievement unlocks under concurrent score submissions.
+
+Runs on the storage backend named by STORAGE_BACKEND (in-memory by default).
+With STORAGE_BACKEND=mongo it uses a throwaway database on MONGO_URL and is
+skipped when no server is reachable.
+
+Operations of the in-memory engine never suspend, so on their own the
+submissions would run one after another. The latency variant yields to the
+event loop around every storage call, as a database round trip would, so
+the submissions interleave between reading a player's unlocks and writing
+new ones.
+"""
+import inspect
+import asyncio
+import json
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "memory")
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+PARALLEL_SUBMISSIONS = 300
+
+
+def mongo_available() -> bool:
+    try:
+        MongoClient(MONGO_URL, serverSelectionTimeoutMS=1000).admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+
+
+pytestmark = pytest.mark.skipif(
+    STORAGE_BACKEND == "mongo" and not mongo_available(), reason="MongoDB is not reachable"
+)
+
+
+def add_round_trips(repository, monkeypatch):
+    """Make every storage call suspend before and after it runs"""
+    for name, method in inspect.getmembers(repository, inspect.iscoroutinefunction):
+        async def with_round_trip(*args, _method=method, **kwargs):
+            await asyncio.sleep(0)
+            result = await _method(*args, **kwargs)
+            await asyncio.sleep(0)
+            return result
+        monkeypatch.setattr(repository, name, with_round_trip)
+
+
+@pytest.mark.parametrize("latency", [False, True], ids=["direct", "latency"])
+def test_parallel_scores_unlock_each_achievement_once(monkeypatch, latency):
+    if latency and STORAGE_BACKEND == "mongo":
+        pytest.skip("MongoDB round trips already interleave the submissions")
+    monkeypatch.setenv("STORAGE_BACKEND", STORAGE_BACKEND)
+    monkeypatch.setenv("MONGO_URL", MONGO_URL)
+    monkeypatch.setenv("DB_NAME", f"plastic_bag_king_stress_{uuid.uuid4().hex[:8]}")
+
+    from server import repository
+    from achievements import ACHIEVEMENTS, unlock_mask
+    from game_routes import save_score
+    from models import GameScoreCreate
+
+    player_name = f"stress-player-{uuid.uuid4().hex[:8]}"
+    score = GameScoreCreate(player_name=player_name, height=300, completed=True, completion_time=60)
+
+    if latency:
+        add_round_trips(repository, monkeypatch)
+    # Every id any add_unlocks call reported as newly unlocked
+    created = []
+    add_unlocks = repository.add_unlocks
+
+    async def recording_add_unlocks(name, achievement_ids):
+        ids = await add_unlocks(name, achievement_ids)
+        created.extend(ids)
+        return ids
+    monkeypatch.setattr(repository, "add_unlocks", recording_add_unlocks)
+
+    async def run():
+        await repository.ensure_indexes()
+        try:
+            responses = await asyncio.gather(*(save_score(score) for _ in range(PARALLEL_SUBMISSIONS)))
+            unlocks = await repository.get_unlocks(player_name)
+            stats = await repository.get_player_stats(player_name)
+            if STORAGE_BACKEND == "mongo":
+                stored = await repository.db.player_unlocks.find_one({"_id": player_name})
+            else:
+                stored = repository.unlocks[player_name]
+            return responses, unlocks, stored, stats
+        finally:
+            if STORAGE_BACKEND == "mongo":
+                await repository.client.drop_database(repository.db.name)
+            await repository.close()
+
+    responses, unlocks, stored, stats = asyncio.run(run())
+    bodies = [json.loads(response.body) for response in responses]
+
+    assert all(body["success"] for body in bodies)
+    assert sum(body["new_record"] for body in bodies) == 1
+    assert stats["games_played"] == PARALLEL_SUBMISSIONS
+    assert set(unlocks) == {achievement["id"] for achievement in ACHIEVEMENTS}
+    assert sorted(created) == sorted(achievement["id"] for achievement in ACHIEVEMENTS)
+    assert all(unlocked_at is not None for unlocked_at in unlocks.values())
+    # One bit and one first-unlock time per achievement, however many requests raced
+    assert stored["mask"] == unlock_mask(achievement["id"] for achievement in ACHIEVEMENTS)
+    assert set(stored["ts"]) == {str(achievement["bit"]) for achievement in ACHIEVEMENTS}
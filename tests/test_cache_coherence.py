@@ -0,0 +1,77 @@
+"""
+Cache coherence between worker processes, through the SQLite stand-in for
+the version-stamp document.
+"""
+import asyncio
+import multiprocessing
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from coherence import CacheCoherence, SqliteVersionStore
+
+# Records kept in the version document, small enough to fall behind in the test
+KEEP = 5
+
+
+def publish_from_worker(path: str, records: list):
+    """Run in a separate process: publish records as another worker would"""
+    async def run():
+        coherence = CacheCoherence(SqliteVersionStore(path), {}, resync=None, keep=KEEP)
+        for kind, fields in records:
+            coherence.publish(kind, **fields)
+        await coherence.flush()
+
+    asyncio.run(run())
+
+
+def run_worker(path: str, records: list):
+    process = multiprocessing.get_context("spawn").Process(target=publish_from_worker, args=(path, records))
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+
+
+def test_changes_from_other_workers_invalidate_only_their_keys(tmp_path):
+    path = str(tmp_path / "cache_versions.db")
+    applied = []
+    resyncs = []
+
+    async def resync():
+        resyncs.append(True)
+
+    coherence = CacheCoherence(
+        SqliteVersionStore(path),
+        {
+            "unlocks": lambda player_name: applied.append(("unlocks", player_name)),
+            "stats": lambda: applied.append(("stats",)),
+        },
+        resync,
+        # Synced by hand below rather than by the background loop
+        interval=60,
+        keep=KEEP
+    )
+
+    async def run():
+        # History published before this worker starts is not replayed
+        run_worker(path, [("stats", {})])
+        await coherence.start()
+        try:
+            run_worker(path, [("unlocks", {"player_name": "ana"}), ("stats", {}), ("stats", {})])
+            # This worker's own records are skipped when read back
+            coherence.publish("unlocks", player_name="own")
+            await coherence.flush()
+            await coherence.sync()
+            assert applied == [("unlocks", "ana"), ("stats",)]
+            assert not resyncs
+
+            # Falling further behind than the kept records rebuilds everything
+            run_worker(path, [("unlocks", {"player_name": f"p{i}"}) for i in range(8)])
+            await coherence.sync()
+            assert resyncs == [True]
+            assert applied == [("unlocks", "ana"), ("stats",)]
+        finally:
+            await coherence.stop()
+
+    asyncio.run(run())
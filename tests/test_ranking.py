@@ -0,0 +1,60 @@
+"""
+RankIndex against a plain sorted list of the same players, through a random
+run of inserts, score changes and removals.
+"""
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from ranking import RankIndex, decode_cursor, rank_key
+
+OPERATIONS = 2000
+
+
+def test_rank_slice_and_page_match_a_sorted_list():
+    rng = random.Random(1234)
+    index = RankIndex()
+    players = {}
+
+    for step in range(OPERATIONS):
+        name = f"p{rng.randrange(300)}"
+        if name in players and rng.random() < 0.2:
+            index.remove(name)
+            del players[name]
+        else:
+            # Few distinct heights so ties fall back to completions and name
+            height, completions = rng.randrange(20), rng.randrange(5)
+            index.update(name, height, completions)
+            players[name] = (height, completions)
+
+        if step % 50:
+            continue
+        expected = sorted(players, key=lambda player: rank_key(player, *players[player]))
+        assert len(index) == len(expected)
+
+        for position, player in enumerate(expected):
+            assert index.rank(player) == position + 1
+        assert index.rank("nobody") is None
+
+        start = rng.randrange(len(expected) + 2)
+        entries = index.slice(start, 10)
+        assert [entry["name"] for entry in entries] == expected[start:start + 10]
+        assert [entry["rank"] for entry in entries] == list(range(start + 1, start + 1 + len(entries)))
+
+        paged, cursor = [], None
+        while True:
+            entries, cursor = index.page(decode_cursor(cursor) if cursor else None, 7)
+            paged.extend(entries)
+            if cursor is None:
+                break
+        assert [entry["name"] for entry in paged] == expected
+        assert [entry["rank"] for entry in paged] == list(range(1, len(expected) + 1))
+
+        if expected:
+            # A cursor whose player has since moved or left still resumes in order
+            gone = rank_key("zz-removed", *players[expected[len(expected) // 2]])
+            entries, _ = index.page(gone, len(expected))
+            following = [player for player in expected if rank_key(player, *players[player]) > gone]
+            assert [entry["name"] for entry in entries] == following